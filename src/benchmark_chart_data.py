@@ -0,0 +1,82 @@
+import argparse
+import datetime
+import time
+from typing import Callable, Dict, List, Tuple
+
+from src.web_app.mwis_database import EMPTY_SNAPSHOT, apply_new_rows, get_raw_forecasts
+
+
+LOCATIONS = ["cairngorms-np-and-monadhliath", "southeastern-highlands", "the-northwest-highlands", "west-highlands"]
+
+# The (location, attribute) lookups made by the preparation functions in src/web_app/charts.py
+PREP_ATTRIBUTES = ["freezing_level", "how_windy", "how_windy", "chance_cloud_free", "how_wet", "how_wet"]
+
+
+def make_rows(num_rows: int) -> List[Dict]:
+    """Synthetic mwis rows in id order, with forecasts 0, 1 and 2 days ahead for each location and date as the scraper stores them
+    """
+    rows = []
+    start = datetime.date(2020, 9, 1)
+
+    for i in range(num_rows):
+        day, rest = divmod(i, 3 * len(LOCATIONS))
+        location_index, days_ahead = divmod(rest, 3)
+
+        rows.append({"id": i + 1,
+                     "location": LOCATIONS[location_index],
+                     "date": str(start + datetime.timedelta(days=day + days_ahead)),
+                     "days_ahead": str(days_ahead),
+                     **{attr: f"{attr} {i}" for attr in PREP_ATTRIBUTES}})
+
+    return rows
+
+
+def prep_with_scans(rows: List[Dict]) -> List:
+    """Original lookup, a scan of every row for each (location, attribute)
+    """
+    return [get_raw_forecasts(rows, loc, attr) for attr in PREP_ATTRIBUTES for loc in LOCATIONS]
+
+
+def prep_with_index(rows: List[Dict]) -> List:
+    """Index built in one pass, as ForecastCache does on a full reload, then read for each (location, attribute)
+    """
+    return prep_from_snapshot(apply_new_rows(EMPTY_SNAPSHOT, rows))
+
+
+def prep_from_snapshot(snapshot) -> List:
+    """Reads only, the cost per render once ForecastCache holds the index
+    """
+    return [snapshot.latest_forecasts(loc, attr) for attr in PREP_ATTRIBUTES for loc in LOCATIONS]
+
+
+def time_prep(prep: Callable, prep_input, repeats: int) -> Tuple[float, List]:
+    """Get the mean time in ms per preparation, along with the output of the last run
+    """
+    start = time.perf_counter()
+
+    for _ in range(repeats):
+        output = prep(prep_input)
+
+    return 1000 * (time.perf_counter() - start) / repeats, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare chart data preparation time against number of rows")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000, 50000])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'scans (ms)':>12} {'build+read (ms)':>16} {'read (ms)':>10} {'speedup':>8}  identical")
+
+    for num_rows in args.sizes:
+        rows = make_rows(num_rows)
+
+        scan_ms, scan_output = time_prep(prep_with_scans, rows, args.repeats)
+        index_ms, index_output = time_prep(prep_with_index, rows, args.repeats)
+        read_ms, _ = time_prep(prep_from_snapshot, apply_new_rows(EMPTY_SNAPSHOT, rows), args.repeats)
+
+        print(f"{num_rows:>8} {scan_ms:>12.2f} {index_ms:>16.2f} {read_ms:>10.2f} {scan_ms / read_ms:>7.1f}x  {scan_output == index_output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import argparse
+import resource
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.web_app.charts import chart_window, get_main_image
+from src.web_app.mwis_database import forecast_cache
+from src.web_app.render_pool import RenderPool
+
+
+def render(snapshot, start, end) -> bytes:
+    return get_main_image(snapshot, start, end).getvalue()
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render charts concurrently through the render pool and check "
+                                                 "every image matches the one rendered on its own")
+    parser.add_argument("--requests", type=int, default=24, help="Renders submitted at once")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    snapshot = forecast_cache.snapshot()
+    windows = [chart_window(days=7), chart_window(days=30), chart_window()]
+
+    # Also prepares the series, so that the timings below are rendering only
+    start = time.perf_counter()
+    expected = {window: render(snapshot, *window) for window in windows}
+    serial_time = time.perf_counter() - start
+    print(f"Serial: {len(windows) / serial_time:.2f} renders/sec, max RSS {max_rss_mb():.0f} MB")
+
+    pool = RenderPool(workers=args.workers, max_queued=args.requests)
+    jobs = [windows[i % len(windows)] for i in range(args.requests)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.requests) as requests:
+        images = list(requests.map(lambda window: pool.render(render, snapshot, *window), jobs))
+    parallel_time = time.perf_counter() - start
+
+    num_wrong = sum(image != expected[window] for image, window in zip(images, jobs))
+    print(f"{args.workers} workers: {len(jobs) / parallel_time:.2f} renders/sec, max RSS {max_rss_mb():.0f} MB, "
+          f"{num_wrong} of {len(jobs)} images differ from the serial render")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import time
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+from bs4 import BeautifulSoup
+
+from src.page_archive import get_archived_pages, load_archived_page
+from src.scrape_latest_mwis import extract_forecasts_for_area, extract_forecast_for_day
+
+
+def extract_forecasts_multi_walk(location: str, content: bytes, all_forecasts: List) -> None:
+    """Original extractor, with a separate search of the tree for every section
+    """
+    soup = BeautifulSoup(content, 'html.parser')
+
+    for i in range(3):
+        all_forecasts.append(extract_forecast_for_day(location, i, soup, all_forecasts))
+
+
+def load_pages(pages_dir: Path = None) -> List[Tuple[str, bytes]]:
+    """Get (location, content) for saved pages, either from a directory of <location>*.html files or the archive
+    """
+    if pages_dir is not None:
+        return [(p.stem.split("_")[0], p.read_bytes()) for p in sorted(pages_dir.glob("*.html"))]
+
+    return [(location, load_archived_page(content_hash)) for location, content_hash in get_archived_pages()]
+
+
+def time_extractor(extractor: Callable, pages: List[Tuple[str, bytes]], repeats: int) -> Tuple[float, List]:
+    """Get pages/sec over repeated runs, along with the output of the last run
+    """
+    start = time.perf_counter()
+
+    for _ in range(repeats):
+        forecasts = []
+        for location, content in pages:
+            extractor(location, content, forecasts)
+
+    elapsed = time.perf_counter() - start
+
+    return len(pages) * repeats / elapsed, forecasts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare MWIS page extractors on saved pages")
+    parser.add_argument("--pages-dir", type=Path, default=None, help="Directory of saved .html pages (default: use the page archive)")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    pages = load_pages(args.pages_dir)
+    assert pages, "No saved pages found"
+
+    extractors = {"multi-walk, html.parser": extract_forecasts_multi_walk,
+                  "single-pass, html.parser": lambda *a: extract_forecasts_for_area(*a, parser="html.parser")}
+
+    try:
+        import lxml
+        extractors["single-pass, lxml"] = lambda *a: extract_forecasts_for_area(*a, parser="lxml")
+    except ImportError:
+        print("lxml not installed, skipping")
+
+    baseline = None
+
+    print(f"{len(pages)} pages, {args.repeats} repeats")
+
+    for name, extractor in extractors.items():
+        pages_per_sec, forecasts = time_extractor(extractor, pages, args.repeats)
+        output = [vars(f) for f in forecasts]
+
+        if baseline is None:
+            baseline = output
+
+        print(f"{name:>26}: {pages_per_sec:8.1f} pages/sec, output identical to original: {output == baseline}")
+
+
+if __name__ == "__main__":
+    main()
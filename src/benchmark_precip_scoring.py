@@ -0,0 +1,89 @@
+import argparse
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import spacy
+
+from src.database_connection import connect
+from src.database_functions import execute_query
+from src.utils import database_cache_path
+from src.web_app import mwis_utils
+from src.web_app.mwis_utils import PIPE_BATCH_SIZE, doc_precip_scores, normalise_precip_text, precip_scores_batch
+from src.web_app.precip_score_cache import PrecipScoreCache
+
+
+def load_how_wet(since: Optional[str]) -> List[str]:
+    conn = connect(database_cache_path())
+    cur = conn.cursor()
+
+    if since is None:
+        execute_query("SELECT how_wet FROM mwis_all", cur)
+    else:
+        execute_query("SELECT how_wet FROM mwis_all WHERE date >= ?", cur, (since,))
+
+    texts = [x[0] for x in cur.fetchall()]
+    conn.close()
+    return texts
+
+
+def score_one_at_a_time(nlp, texts: List[str]) -> List[Optional[Tuple[int, int]]]:
+    """Original approach, each text run through the full pipeline on its own
+    """
+    scores = []
+    for text in texts:
+        try:
+            scores.append(doc_precip_scores(nlp(normalise_precip_text(text))))
+        except AssertionError:
+            scores.append(None)
+
+    return scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time scoring how_wet texts one at a time with the full spaCy "
+                                                 "pipeline against precip_scores_batch, with an empty score cache "
+                                                 "and then after a restart with the cache on disk")
+    parser.add_argument("--since", help="Only forecasts from this date (YYYY-MM-DD), e.g. the start of the season")
+    parser.add_argument("--batch-size", type=int, default=PIPE_BATCH_SIZE)
+    parser.add_argument("--n-process", type=int, nargs="+", default=[1, 2])
+    args = parser.parse_args()
+
+    texts = load_how_wet(args.since)
+    print(f"{len(texts)} texts, {len(set(map(normalise_precip_text, texts)))} distinct")
+
+    full_nlp = spacy.load("en_core_web_md")
+    start = time.perf_counter()
+    expected = score_one_at_a_time(full_nlp, texts)
+    baseline = time.perf_counter() - start
+    print(f"One at a time, full pipeline: {baseline:.2f}s")
+
+    # Scores are saved to a temporary file rather than the real cache, so the batched runs start from nothing
+    fingerprint = mwis_utils.score_cache.fingerprint
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_process in args.n_process:
+            cache_path = Path(tmp_dir) / f"scores-{n_process}.db"
+            mwis_utils.score_cache = PrecipScoreCache(cache_path, fingerprint)
+
+            start = time.perf_counter()
+            scores = precip_scores_batch(texts, batch_size=args.batch_size, n_process=n_process)
+            elapsed = time.perf_counter() - start
+
+            assert scores == expected
+            print(f"Batched, n_process={n_process}: {elapsed:.2f}s ({baseline / elapsed:.1f}x faster)")
+
+        # As after a restart, a new cache object which reads the scores saved above
+        mwis_utils.score_cache = PrecipScoreCache(cache_path, fingerprint)
+
+        start = time.perf_counter()
+        scores = precip_scores_batch(texts, batch_size=args.batch_size)
+        elapsed = time.perf_counter() - start
+
+        assert scores == expected
+        print(f"Batched, from the score cache on disk: {elapsed:.2f}s ({baseline / elapsed:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
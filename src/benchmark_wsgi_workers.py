@@ -0,0 +1,108 @@
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+
+CONFIG_PATH = Path(__file__).parent / "web_app" / "gunicorn_conf.py"
+STARTUP_TIMEOUT = 300  # Seconds, loading the spaCy model and preparing the series can take a while
+
+
+def memory_kb(pid: int) -> Dict[str, int]:
+    """Rss, Pss and private (unshared) memory of a process in kB. Pss splits each shared page between the
+    processes sharing it, so unlike Rss it can be summed over the workers.
+    """
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+
+    return {"rss": fields["Rss"], "pss": fields["Pss"], "private": fields["Private_Clean"] + fields["Private_Dirty"]}
+
+
+def child_pids(pid: int) -> List[int]:
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(p) for p in f.read().split()]
+
+
+def wait_until_serving(url: str, server: subprocess.Popen) -> None:
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+
+        try:
+            with urllib.request.urlopen(url, timeout=5):
+                return
+        except OSError:
+            time.sleep(0.5)
+
+    raise TimeoutError(f"Server did not start within {STARTUP_TIMEOUT}s")
+
+
+def get(url: str) -> int:
+    with urllib.request.urlopen(url, timeout=120) as response:
+        response.read()
+        return response.status
+
+
+def run_load(base_url: str, paths: List[str], num_requests: int, concurrency: int) -> float:
+    """Requests per second over num_requests requests cycling through paths"""
+    urls = [base_url + paths[i % len(paths)] for i in range(num_requests)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        statuses = list(clients.map(get, urls))
+    elapsed = time.perf_counter() - start
+
+    assert all(status == 200 for status in statuses)
+    return num_requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-worker memory and requests/sec of the pre-fork server mode "
+                                                 "as the number of workers grows. Run from the repository root.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--paths", nargs="+", default=["/api/chart_data", "/main_image.png?days=14", "/charts/wind.png?days=30"])
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    print(f"{'workers':>7} {'req/s':>8} {'master RSS':>11} {'worker RSS':>11} {'worker PSS':>11} {'worker private':>15}  (MB, mean per worker)")
+
+    for num_workers in args.workers:
+        env = dict(os.environ, MWIS_WORKERS=str(num_workers), MWIS_BIND=f"127.0.0.1:{args.port}")
+        server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", str(CONFIG_PATH), "src.web_app.wsgi:app"],
+                                  env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        try:
+            wait_until_serving(base_url + "/metrics", server)
+
+            # Each worker renders and caches the images once, the timed run then mostly measures serving
+            run_load(base_url, args.paths, len(args.paths) * num_workers * 2, args.concurrency)
+            requests_per_sec = run_load(base_url, args.paths, args.requests, args.concurrency)
+
+            master = memory_kb(server.pid)
+            workers = [memory_kb(pid) for pid in child_pids(server.pid)]
+            mean = {k: sum(w[k] for w in workers) / len(workers) / 1e3 for k in workers[0]}
+
+            print(f"{num_workers:>7} {requests_per_sec:>8.1f} {master['rss'] / 1e3:>11.0f} {mean['rss']:>11.0f} "
+                  f"{mean['pss']:>11.0f} {mean['private']:>15.0f}")
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+
+from src.database_connection import database_connection
+from src.database_functions import execute_query
+from src.mwis_forecast import MwisForecast
+from src.utils import database_cache_path, mwis_export_dir, setup_logging, write_atomically
+
+
+logger = logging.getLogger(__name__)
+
+
+CHUNK_ROWS = 10000
+
+FORMAT_SUFFIXES = {"parquet": ".parquet", "arrow": ".arrow"}
+
+
+def mwis_schema():
+    import pyarrow as pa
+
+    typed_columns = {"id": pa.int64(), "date": pa.date32(), "days_ahead": pa.int32()}
+
+    # Every other column is text, as in setup_database, so new MwisForecast fields are exported too
+    text_columns = [k for k in MwisForecast() if k not in typed_columns]
+
+    return pa.schema([(k, v) for k, v in typed_columns.items()] + [(k, pa.string()) for k in text_columns])
+
+
+def read_high_water_mark(export_dir: Path) -> int:
+    """Largest mwis id already exported, 0 if nothing has been exported yet
+    """
+    path = export_dir / "_high_water_mark.json"
+    return json.loads(path.read_text())["id"] if path.exists() else 0
+
+
+def write_high_water_mark(export_dir: Path, max_id: int) -> None:
+    write_atomically(export_dir / "_high_water_mark.json", json.dumps({"id": max_id}).encode())
+
+
+def reset_export(export_dir: Path) -> None:
+    """Delete the exported partitions and the high water mark, so that the next export starts again from id 0.
+    Needed after the mwis table is rebuilt by src/page_archive.py, which gives rebuilt rows new ids.
+    """
+    if not export_dir.exists():
+        return
+
+    for partition_dir in export_dir.glob("month=*"):
+        shutil.rmtree(partition_dir)
+
+    (export_dir / "_high_water_mark.json").unlink(missing_ok=True)
+
+    logger.info(f"Reset export in {export_dir}")
+
+
+def export_mwis_table(export_dir: Path = None, fmt: str = "parquet", chunk_rows: int = CHUNK_ROWS) -> int:
+    """Append forecasts added since the last export to columnar files partitioned by forecast month,
+    e.g. export_dir/month=2023-01/part-000000101-000000160.parquet. Returns the number of rows exported.
+    """
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+
+    if export_dir is None:
+        export_dir = mwis_export_dir() / fmt
+
+    db_path = database_cache_path()
+    assert db_path.exists()
+
+    export_dir.mkdir(parents=True, exist_ok=True)
+    schema = mwis_schema()
+    high_water_mark = read_high_water_mark(export_dir)
+
+    writers = {}
+    tmp_paths = {}
+    num_rows = 0
+    max_id = high_water_mark
+
+    with database_connection(db_path) as conn:
+        cursor = conn.cursor()
+        execute_query(f"SELECT {','.join(schema.names)} FROM mwis_all WHERE id > ? ORDER BY id", cursor, (high_water_mark,))
+
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+
+            # Group the chunk by month of the forecast date, and convert to typed columns
+            by_month = {}
+            for row in rows:
+                row = dict(zip(schema.names, row))
+                row["date"] = datetime.date.fromisoformat(row["date"])
+                row["days_ahead"] = int(row["days_ahead"])
+                by_month.setdefault(row["date"].strftime("%Y-%m"), []).append(row)
+
+            for month, month_rows in by_month.items():
+                table = pa.Table.from_pylist(month_rows, schema=schema)
+
+                if month not in writers:
+                    # Written under a temporary name, renamed once complete so readers never see a partial file
+                    partition_dir = export_dir / f"month={month}"
+                    partition_dir.mkdir(exist_ok=True)
+                    tmp_paths[month] = partition_dir / f".part-{high_water_mark + 1:09d}.tmp"
+                    if fmt == "parquet":
+                        writers[month] = pq.ParquetWriter(str(tmp_paths[month]), schema, compression="zstd")
+                    else:
+                        writers[month] = pa.ipc.new_file(str(tmp_paths[month]), schema)
+
+                writers[month].write_table(table)
+
+            num_rows += len(rows)
+            max_id = rows[-1][0]
+
+    for month, writer in writers.items():
+        writer.close()
+        final_path = tmp_paths[month].parent / f"part-{high_water_mark + 1:09d}-{max_id:09d}{FORMAT_SUFFIXES[fmt]}"
+        os.replace(tmp_paths[month], final_path)
+
+    # Only advanced once every file is in place, so a failed run is simply repeated next time
+    write_high_water_mark(export_dir, max_id)
+
+    logger.info(f"Exported {num_rows} new rows to {len(writers)} partitions, high water mark now id={max_id}")
+
+    return num_rows
+
+
+def load_mwis_export(export_dir: Path = None, fmt: str = "parquet"):
+    """Read the whole export as a pandas DataFrame. Arrow IPC files are memory-mapped rather than parsed.
+    """
+    import pyarrow.dataset as ds
+    from pyarrow.fs import LocalFileSystem
+
+    if export_dir is None:
+        export_dir = mwis_export_dir() / fmt
+
+    dataset = ds.dataset(str(export_dir), format="parquet" if fmt == "parquet" else "ipc", partitioning="hive",
+                         filesystem=LocalFileSystem(use_mmap=True), ignore_prefixes=[".", "_"])
+
+    return dataset.to_table().to_pandas()
+
+
+def main():
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Incremental columnar export of the mwis table")
+    parser.add_argument("--format", choices=list(FORMAT_SUFFIXES), default="parquet")
+    parser.add_argument("--export-dir", type=Path, default=None, help="Default: ~/.scottish-winter-coding/export/<format>")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--reset", action="store_true", help="Export every row again, e.g. after reparsing the page archive")
+    args = parser.parse_args()
+
+    if args.reset:
+        reset_export(args.export_dir or mwis_export_dir() / args.format)
+
+    export_mwis_table(args.export_dir, args.format, args.chunk_rows)
+
+
+if __name__ == "__main__":
+    main()
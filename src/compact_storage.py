@@ -0,0 +1,193 @@
+import argparse
+import logging
+import sqlite3
+import tempfile
+from pathlib import Path
+
+from src.database_connection import connect, database_connection
+from src.database_functions import execute_query
+from src.forecast_search import create_search_triggers
+from src.mwis_forecast import MwisForecast
+from src.utils import database_cache_path, setup_logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# Free-text fields, stored as references into mwis_phrases. location, date and days_ahead stay inline
+# as they are short and make up the unique index.
+PHRASE_FIELDS = ["chance_cloud_free", "cloud_on_hills", "freezing_level", "headline", "how_cold", "how_wet", "how_windy", "sunshine"]
+
+
+def is_compact(cursor, table: str) -> bool:
+    execute_query("SELECT type FROM sqlite_master WHERE name = ?", cursor, (table,))
+    row = cursor.fetchone()
+    return row is not None and row[0] == "view"
+
+
+def compact_table(cursor, table: str, other_table: str) -> None:
+    """Replace table with {table}_compact, holding phrase ids, plus a view named table which has the
+    original row shape. INSTEAD OF triggers on the view intern new phrases, so code inserting into and
+    deleting from table works unchanged. Must run inside a transaction.
+    """
+    compact = f"{table}_compact"
+    attr_names = list(MwisForecast())
+
+    # mwis keeps AUTOINCREMENT so ids are never reused, mwis_archive takes its ids from mwis
+    autoincrement = " AUTOINCREMENT" if table == "mwis" else ""
+    phrase_columns = ", ".join(f"{k}_id integer NOT NULL REFERENCES mwis_phrases (id)" for k in PHRASE_FIELDS)
+    execute_query(f"""CREATE TABLE {compact} (
+                      id integer PRIMARY KEY{autoincrement},
+                      location text NOT NULL,
+                      date text NOT NULL,
+                      days_ahead text NOT NULL,
+                      {phrase_columns}
+                      )""", cursor)
+
+    for k in PHRASE_FIELDS:
+        execute_query(f"INSERT OR IGNORE INTO mwis_phrases (text) SELECT {k} FROM {table}", cursor)
+
+    id_columns = ", ".join(f"{k}_id" for k in PHRASE_FIELDS)
+    phrase_lookups = ", ".join(f"(SELECT id FROM mwis_phrases WHERE text = t.{k})" for k in PHRASE_FIELDS)
+    execute_query(f"""INSERT INTO {compact} (id, location, date, days_ahead, {id_columns})
+                      SELECT t.id, t.location, t.date, t.days_ahead, {phrase_lookups} FROM {table} t""", cursor)
+
+    if table == "mwis":
+        execute_query("DELETE FROM sqlite_sequence WHERE name = 'mwis_compact'", cursor)
+        execute_query("INSERT INTO sqlite_sequence (name, seq) SELECT 'mwis_compact', seq FROM sqlite_sequence WHERE name = 'mwis'", cursor)
+
+    # Dropping the table also drops its indexes and search triggers, recreated on the compact table below
+    execute_query(f"DROP TABLE {table}", cursor)
+
+    if table == "mwis":
+        execute_query("CREATE UNIQUE INDEX mwis_location_date_days_ahead ON mwis_compact (location, date, days_ahead)", cursor)
+    else:
+        execute_query(f"CREATE INDEX {table}_location_date ON {compact} (location, date)", cursor)
+
+    # LEFT JOINs on the phrase primary key let SQLite skip the lookups for columns a query does not use
+    view_columns = ", ".join(f"p_{k}.text AS {k}" if k in PHRASE_FIELDS else f"c.{k}" for k in attr_names)
+    joins = " ".join(f"LEFT JOIN mwis_phrases p_{k} ON p_{k}.id = c.{k}_id" for k in PHRASE_FIELDS)
+    execute_query(f"CREATE VIEW {table} AS SELECT c.id, {view_columns} FROM {compact} c {joins}", cursor)
+
+    new_phrases = ", ".join(f"(new.{k})" for k in PHRASE_FIELDS)
+    new_lookups = ", ".join(f"(SELECT id FROM mwis_phrases WHERE text = new.{k})" for k in PHRASE_FIELDS)
+
+    # The conflict policy of the inserting statement (e.g. INSERT OR IGNORE) applies to these inserts too
+    execute_query(f"""CREATE TRIGGER {table}_insert INSTEAD OF INSERT ON {table} BEGIN
+                      INSERT OR IGNORE INTO mwis_phrases (text) VALUES {new_phrases};
+                      INSERT INTO {compact} (id, location, date, days_ahead, {id_columns})
+                      VALUES (new.id, new.location, new.date, new.days_ahead, {new_lookups});
+                      END""", cursor)
+
+    execute_query(f"""CREATE TRIGGER {table}_delete INSTEAD OF DELETE ON {table} BEGIN
+                      DELETE FROM {compact} WHERE id = old.id;
+                      END""", cursor)
+
+    execute_query("SELECT name FROM sqlite_master WHERE name = 'mwis_search'", cursor)
+    if cursor.fetchone() is not None:
+        create_search_triggers(cursor, compact, table, other_table)
+
+
+def enable_compact_storage(conn: sqlite3.Connection) -> None:
+    """Convert mwis and mwis_archive to phrase-encoded storage. Has no effect on tables already converted.
+    """
+    cursor = conn.cursor()
+
+    with conn:
+        # Explicit, as sqlite3 would otherwise run the CREATE statements outside the transaction
+        execute_query("BEGIN", cursor)
+        execute_query("CREATE TABLE IF NOT EXISTS mwis_phrases (id integer PRIMARY KEY, text text NOT NULL UNIQUE)", cursor)
+
+        for table, other_table in [("mwis", "mwis_archive"), ("mwis_archive", "mwis")]:
+            if not is_compact(cursor, table):
+                compact_table(cursor, table, other_table)
+                logger.info(f"Converted {table} to compact storage")
+
+    # Return the space freed by the dropped tables to the filesystem
+    conn.execute("VACUUM")
+
+
+def database_size(conn: sqlite3.Connection) -> int:
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+def forecast_tables_size(conn: sqlite3.Connection) -> int:
+    """Bytes used by the forecast tables and their indexes, leaving out e.g. the search index. Needs the
+    dbstat virtual table, which not every SQLite build has.
+    """
+    query = """SELECT SUM(pgsize) FROM dbstat WHERE name IN
+               (SELECT name FROM sqlite_master WHERE tbl_name IN
+                ('mwis', 'mwis_archive', 'mwis_compact', 'mwis_archive_compact', 'mwis_phrases'))"""
+
+    return conn.execute(query).fetchone()[0]
+
+
+def compact_storage_report(db_path: Path = None) -> None:
+    """Print the size reduction from compact storage, measured on a copy of the database
+    """
+    if db_path is None:
+        db_path = database_cache_path()
+
+    assert db_path.exists()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        copy_path = Path(tmp_dir) / "data.db"
+
+        with database_connection(db_path) as conn:
+            copy_conn = sqlite3.connect(str(copy_path))
+            conn.backup(copy_conn)
+            copy_conn.close()
+
+        conn = connect(copy_path)
+
+        # Vacuum first as well, so that the comparison is not flattered by free pages in the original
+        conn.execute("VACUUM")
+        size_before = database_size(conn)
+
+        try:
+            tables_size_before = forecast_tables_size(conn)
+        except sqlite3.OperationalError:
+            tables_size_before = None
+
+        num_rows = conn.execute("SELECT COUNT(*) FROM mwis_all").fetchone()[0]
+
+        enable_compact_storage(conn)
+        size_after = database_size(conn)
+        tables_size_after = forecast_tables_size(conn) if tables_size_before is not None else None
+
+        num_phrases = conn.execute("SELECT COUNT(*) FROM mwis_phrases").fetchone()[0]
+        conn.close()
+
+    print(f"{num_rows} forecasts, {num_rows * len(PHRASE_FIELDS)} text values, {num_phrases} distinct phrases")
+    print(f"Database size: {size_before / 1e6:.2f} MB -> {size_after / 1e6:.2f} MB ({100 * (1 - size_after / size_before):.1f}% smaller)")
+
+    if tables_size_before is not None:
+        print(f"Forecast tables and indexes: {tables_size_before / 1e6:.2f} MB -> {tables_size_after / 1e6:.2f} MB "
+              f"({100 * (1 - tables_size_after / tables_size_before):.1f}% smaller)")
+
+
+def main():
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Optional dictionary-encoded storage of forecast text")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("report", help="Report the size reduction, measured on a copy of the database")
+    subparsers.add_parser("enable", help="Convert the database to compact storage, back it up first")
+
+    args = parser.parse_args()
+
+    if args.command == "report":
+        compact_storage_report()
+    elif args.command == "enable":
+        db_path = database_cache_path()
+        assert db_path.exists()
+
+        conn = connect(db_path)
+        enable_compact_storage(conn)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import sqlite3
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from src.utils import database_cache_path
+
+
+logger = logging.getLogger(__name__)
+
+
+BUSY_TIMEOUT_MS = 30000  # How long a writer waits for another writer's lock before "database is locked"
+CACHE_SIZE_KIB = 32000  # Page cache per connection
+STATEMENT_CACHE_SIZE = 256  # Compiled statements kept per connection, keyed by SQL text
+
+
+class QueryError(Exception):
+    """Raised when the database rejects a query, wrapping the underlying sqlite3 error
+    """
+
+
+def connect(db_path: Path = None, check_same_thread: bool = True) -> sqlite3.Connection:
+    """Open a connection to the database with the pragmas that every entry point should use.
+
+    WAL journaling lets readers (the web app) carry on while a writer (the scraper) is mid-transaction,
+    and lets the writer proceed while reads are open, so only writer-writer contention needs the busy timeout.
+    """
+    if db_path is None:
+        db_path = database_cache_path()
+
+    conn = sqlite3.connect(str(db_path), timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=check_same_thread,
+                           cached_statements=STATEMENT_CACHE_SIZE)
+
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+
+    # The journal mode is persistent in the database file, so this is a no-op after the first connection
+    conn.execute("PRAGMA journal_mode = WAL")
+
+    # In WAL mode NORMAL is still crash-safe, it only skips the fsync on every commit
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+
+    return conn
+
+
+@contextmanager
+def database_connection(db_path: Path = None) -> Iterator[sqlite3.Connection]:
+    """Connection which is committed if the block succeeds, rolled back if it raises, and always closed
+    """
+    conn = connect(db_path)
+
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
@@ -1,10 +1,11 @@
-import sqlite3
 import csv
-import sys
+import sqlite3
 import logging
-from typing import List
+from typing import Dict, List
 from pathlib import Path
 
+from src.database_connection import QueryError, database_connection
+from src.mwis_queries import run_query
 from src.utils import database_cache_path
 from src.mwis_forecast import MwisForecast
 
@@ -17,54 +18,78 @@ def execute_query(query: str, cursor, *args) -> None:
         logger.debug(f"Executing query: {query}")
         logger.debug(f"With args: {args}")
         cursor.execute(query, *args)
-    except Exception as e:
+    except sqlite3.Error as e:
         logger.critical(e)
         logger.critical(f"query = {query}")
-        sys.exit()
-
-
-def forecast_already_present(cursor, forecast: MwisForecast) -> bool:
-    query = f"""SELECT * FROM mwis 
-    WHERE location='{forecast.location}' 
-    AND date='{forecast.date}'
-    AND days_ahead='{forecast.days_ahead}'"""
+        raise QueryError(f"{e} in query: {query}") from e
 
-    execute_query(query, cursor)
 
-    #execute_query("SELECT location, date, days_ahead FROM mwis WHERE location='west-highlands'", cursor)
-    #print(cursor.fetchall())
-    #assert 0
-
-    return len(cursor.fetchall()) > 0
+def execute_many_query(query: str, cursor, rows: List) -> None:
+    try:
+        logger.debug(f"Executing query: {query}")
+        logger.debug(f"For {len(rows)} rows")
+        cursor.executemany(query, rows)
+    except sqlite3.Error as e:
+        logger.critical(e)
+        logger.critical(f"query = {query}")
+        raise QueryError(f"{e} in query: {query}") from e
 
 
-def add_mwis_forecast_to_database(all_forecasts: List[MwisForecast]) -> None:
-    """Update database with new forecast. Has no effect if forecast has already been added.
+def add_mwis_forecast_to_database(all_forecasts: List[MwisForecast], replace_existing: bool = False) -> None:
+    """Update database with new forecast. Has no effect if forecast has already been added, unless
+    replace_existing is set, in which case stored rows for the same (location, date, days_ahead) are replaced.
     """
     db_path = database_cache_path()
     assert db_path.exists()
 
-    conn = sqlite3.connect(str(db_path))
-    cursor = conn.cursor()
+    attr_names = list(MwisForecast())
+
+    with database_connection(db_path) as conn:
+        cursor = conn.cursor()
+
+        keys = [(forecast.location, str(forecast.date), str(forecast.days_ahead)) for forecast in all_forecasts]
+
+        if replace_existing:
+            # Deleted in the same transaction as the inserts below, so a failed rebuild loses nothing
+            execute_many_query("DELETE FROM mwis WHERE location=? AND date=? AND days_ahead=?", cursor, keys)
+            execute_many_query("DELETE FROM mwis_archive WHERE location=? AND date=? AND days_ahead=?", cursor, keys)
+
+        # The unique index on (location, date, days_ahead) only covers the hot table, so forecasts which have
+        # been moved to the archive are skipped here. This also gives the number added without counting the
+        # table, as rowcount is always 0 when mwis is a compact storage view.
+        present = set()
+        if keys:
+            dates = [date for _, date, _ in keys]
+            present = {tuple(row) for row in run_query(conn, "forecast_keys_in_date_range",
+                                                       {"start": min(dates), "end": max(dates)})}
+
+        rows = []
+        for key, forecast in zip(keys, all_forecasts):
+            if key not in present:
+                present.add(key)
+                rows.append(tuple(str(getattr(forecast, k)) for k in forecast))
 
-    for forecast in all_forecasts:
-        if forecast_already_present(cursor, forecast):
-            logger.debug(f"Forecast already present for {forecast.location, forecast.date, forecast.days_ahead}")
-            continue
+        query = f"INSERT OR IGNORE INTO mwis ({','.join(attr_names)}) VALUES({','.join(['?'] * len(attr_names))})"
+        execute_many_query(query, cursor, rows)
 
-        logger.debug(f"Forecast not present for {forecast.location, forecast.date, forecast.days_ahead}")
-        logger.debug("Adding to database...")
+        logger.info(f"Added {len(rows)} new forecasts, {len(keys) - len(rows)} were already present")
 
-        values = (None,) + tuple(str(getattr(forecast, k)) for k in forecast)
-        query = f"INSERT INTO mwis VALUES({','.join(['?'] * len(values))})"
-        execute_query(query, cursor, values)
 
-        logger.debug("Added MWIS forecast to database")
+def add_mwis_unique_index(cursor) -> None:
+    """Migration adding the unique index on (location, date, days_ahead). Databases created before
+    the index existed can contain duplicate forecasts, these are removed first keeping the earliest one.
+    """
+    execute_query("SELECT name FROM sqlite_master WHERE type='index' AND name='mwis_location_date_days_ahead'", cursor)
+
+    if cursor.fetchone() is not None:
+        return
 
-    conn.commit()
+    execute_query("""DELETE FROM mwis WHERE id NOT IN
+                     (SELECT MIN(id) FROM mwis GROUP BY location, date, days_ahead)""", cursor)
+    logger.info(f"Removed {cursor.rowcount} duplicate forecasts")
 
-    execute_query("SELECT * FROM mwis", cursor)
-    logger.info(f"Database now contains {len(cursor.fetchall())} rows")
+    execute_query("CREATE UNIQUE INDEX mwis_location_date_days_ahead ON mwis (location, date, days_ahead)", cursor)
+    logger.info("Added unique index on mwis (location, date, days_ahead)")
 
 
 def setup_database() -> None:
@@ -75,39 +100,124 @@ def setup_database() -> None:
     if not db_path.exists():
         db_path.parent.mkdir(exist_ok=True)
 
-    conn = sqlite3.connect(str(db_path))
-    cursor = conn.cursor()
+    with database_connection(db_path) as conn:
+        cursor = conn.cursor()
+
+        attr_names = list(MwisForecast())
+        col_str = " text NOT NULL, ".join(attr_names + [""]).strip(" ,")
+
+        create_mwis_table = f"""CREATE TABLE IF NOT EXISTS mwis (
+                                id integer PRIMARY KEY AUTOINCREMENT,
+                                {col_str}
+                                );"""
+
+        logger.debug(create_mwis_table)
+
+        execute_query(create_mwis_table, cursor)
+
+        add_mwis_unique_index(cursor)
+
+        # Superseded and old-season forecasts are moved here by src/mwis_maintenance.py, keeping their ids
+        create_mwis_archive_table = f"""CREATE TABLE IF NOT EXISTS mwis_archive (
+                                        id integer PRIMARY KEY,
+                                        {col_str}
+                                        );"""
+
+        execute_query(create_mwis_archive_table, cursor)
+
+        # Once src/compact_storage.py has run this index is on mwis_archive_compact instead
+        execute_query("SELECT type FROM sqlite_master WHERE name='mwis_archive'", cursor)
+        if cursor.fetchone()[0] == "table":
+            execute_query("CREATE INDEX IF NOT EXISTS mwis_archive_location_date ON mwis_archive (location, date)", cursor)
+
+        # Full history, for anything which is not on the web app's hot path
+        columns = ", ".join(["id"] + attr_names)
+        execute_query(f"""CREATE VIEW IF NOT EXISTS mwis_all AS
+                          SELECT {columns} FROM mwis UNION ALL SELECT {columns} FROM mwis_archive""", cursor)
+
+        # Imported here as src/forecast_search.py uses execute_query from this module
+        from src.forecast_search import setup_search_index
+        setup_search_index(cursor)
+
+        create_fetch_state_table = """CREATE TABLE IF NOT EXISTS mwis_fetch_state (
+                                      url text PRIMARY KEY,
+                                      etag text,
+                                      last_modified text,
+                                      content_hash text NOT NULL
+                                      );"""
+
+        execute_query(create_fetch_state_table, cursor)
+
+        create_page_archive_table = """CREATE TABLE IF NOT EXISTS mwis_page_archive (
+                                       id integer PRIMARY KEY AUTOINCREMENT,
+                                       location text NOT NULL,
+                                       url text NOT NULL,
+                                       fetched_at text NOT NULL,
+                                       content_hash text NOT NULL
+                                       );"""
+
+        execute_query(create_page_archive_table, cursor)
+        execute_query("CREATE INDEX IF NOT EXISTS mwis_page_archive_location_fetched_at ON mwis_page_archive (location, fetched_at)", cursor)
+
+        # Typed values computed from the forecast text by src/mwis_features.py, one row per mwis row
+        create_features_table = """CREATE TABLE IF NOT EXISTS mwis_features (
+                                   mwis_id integer PRIMARY KEY,
+                                   freezing_level_min integer,
+                                   freezing_level_max integer,
+                                   wind_min integer,
+                                   wind_max integer,
+                                   wind_directions text,
+                                   cloud_free_min integer,
+                                   cloud_free_max integer,
+                                   rain_score integer,
+                                   snow_score integer,
+                                   parser_version integer NOT NULL
+                                   );"""
+
+        execute_query(create_features_table, cursor)
 
-    attr_names = list(MwisForecast())
-    col_str = " text NOT NULL, ".join(attr_names + [""]).strip(" ,")
+    logger.info("Table setup completed normally")
 
-    create_mwis_table = f"""CREATE TABLE IF NOT EXISTS mwis (
-                            id integer PRIMARY KEY AUTOINCREMENT,
-                            {col_str}
-                            );"""
 
-    logger.debug(create_mwis_table)
+def load_fetch_state() -> Dict[str, Dict]:
+    """Get the HTTP validators and body hash stored for each URL after its last successful fetch
+    """
+    db_path = database_cache_path()
+    assert db_path.exists()
 
-    execute_query(create_mwis_table, cursor)
+    with database_connection(db_path) as conn:
+        cursor = conn.cursor()
 
-    logger.info("Table setup completed normally")
+        execute_query("SELECT url, etag, last_modified, content_hash FROM mwis_fetch_state", cursor)
 
+        return {url: {"etag": etag, "last_modified": last_modified, "content_hash": content_hash}
+                for url, etag, last_modified, content_hash in cursor.fetchall()}
 
-def mwis_table_to_csv(outpath: Path) -> None:
+
+def save_fetch_state(fetch_state: Dict[str, Dict]) -> None:
+    """Store fetch state, to be called only once the corresponding forecasts are in the database
+    """
     db_path = database_cache_path()
     assert db_path.exists()
 
-    conn = sqlite3.connect(str(db_path))
-    cursor = conn.cursor()
+    with database_connection(db_path) as conn:
+        cursor = conn.cursor()
+
+        rows = [(url, state["etag"], state["last_modified"], state["content_hash"]) for url, state in fetch_state.items()]
+        execute_many_query("INSERT OR REPLACE INTO mwis_fetch_state VALUES(?,?,?,?)", cursor, rows)
 
-    execute_query("SELECT * FROM mwis", cursor)
 
-    with open(outpath, "w", newline="") as outfile:
-        writer = csv.writer(outfile)
+def mwis_table_to_csv(outpath: Path) -> None:
+    db_path = database_cache_path()
+    assert db_path.exists()
 
-        for row in cursor:
-            writer.writerow(row)
+    with database_connection(db_path) as conn:
+        cursor = conn.cursor()
 
-    
+        execute_query("SELECT * FROM mwis_all", cursor)
 
+        with open(outpath, "w", newline="") as outfile:
+            writer = csv.writer(outfile)
 
+            for row in cursor:
+                writer.writerow(row)
@@ -0,0 +1,83 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+logger = logging.getLogger(__name__)
+
+
+MAX_IN_FLIGHT = 4  # Cap on concurrent requests, also the size of the keep-alive pool
+REQUEST_TIMEOUT = (5, 30)  # (connect, read) timeouts in seconds, applied to every attempt
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 1.0  # Sleep between retries is BACKOFF_FACTOR * 2 ** (attempt - 1) seconds
+
+
+def make_session(max_in_flight: int = MAX_IN_FLIGHT) -> requests.Session:
+    """Session with a pooled keep-alive connection, which retries transient failures with backoff
+    """
+    retry = Retry(total=MAX_RETRIES,
+                  backoff_factor=BACKOFF_FACTOR,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(["GET"]),
+                  raise_on_status=False)
+
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+
+def fetch_page(session: requests.Session, url: str, headers: Optional[Dict] = None) -> Optional[requests.Response]:
+    """Fetch a single page. Returns None rather than raising if the request ultimately fails,
+    so that one bad URL does not bring down the whole run. A conditional request which finds the
+    page unchanged returns the 304 response.
+    """
+    try:
+        response = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        logger.error(f"Failed to fetch {url}: {e}")
+        return None
+
+    logger.debug(f"Fetched {url} ({response.status_code}) in {response.elapsed.total_seconds():.2f}s")
+
+    return response
+
+
+def fetch_pages(urls: List[str],
+                headers: Optional[Dict[str, Dict]] = None,
+                max_in_flight: int = MAX_IN_FLIGHT) -> Dict[str, Optional[requests.Response]]:
+    """Fetch all URLs concurrently over a shared session, with at most max_in_flight requests
+    running at once. headers optionally maps each URL to extra request headers. Failed fetches map to None.
+    """
+    if not urls:
+        return {}
+
+    if headers is None:
+        headers = {}
+
+    with make_session(max_in_flight) as session:
+        with ThreadPoolExecutor(max_workers=min(max_in_flight, len(urls))) as pool:
+            responses = pool.map(lambda url: fetch_page(session, url, headers.get(url)), urls)
+            return dict(zip(urls, responses))
+
+
+def conditional_headers(state: Dict) -> Dict:
+    """Build If-None-Match/If-Modified-Since headers from the validators stored after the last fetch
+    """
+    headers = {}
+
+    if state.get("etag"):
+        headers["If-None-Match"] = state["etag"]
+
+    if state.get("last_modified"):
+        headers["If-Modified-Since"] = state["last_modified"]
+
+    return headers
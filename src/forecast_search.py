@@ -0,0 +1,94 @@
+import argparse
+import logging
+from typing import List
+
+from src.database_connection import database_connection
+from src.database_functions import execute_query
+from src.mwis_queries import run_query
+from src.utils import database_cache_path
+
+
+logger = logging.getLogger(__name__)
+
+
+SEARCH_FIELDS = ["headline", "how_wet", "how_windy", "cloud_on_hills", "chance_cloud_free", "sunshine", "how_cold", "freezing_level"]
+
+
+def setup_search_index(cursor) -> None:
+    """Create the mwis_search FTS5 index over the forecast text, with triggers keeping it in sync with
+    mwis and mwis_archive. The index rowid is the forecast id. Populated from existing rows on creation.
+    """
+    execute_query("SELECT name FROM sqlite_master WHERE name='mwis_search'", cursor)
+
+    if cursor.fetchone() is not None:
+        return
+
+    # Porter stemming, so that e.g. "thaw" also finds "thawing"
+    execute_query(f"""CREATE VIRTUAL TABLE mwis_search USING fts5(
+                      {', '.join(SEARCH_FIELDS)},
+                      location UNINDEXED, date UNINDEXED, days_ahead UNINDEXED,
+                      tokenize='porter unicode61')""", cursor)
+
+    create_search_triggers(cursor, "mwis", "mwis", "mwis_archive")
+    create_search_triggers(cursor, "mwis_archive", "mwis_archive", "mwis")
+
+    columns = ", ".join(SEARCH_FIELDS + ["location", "date", "days_ahead"])
+    execute_query(f"INSERT INTO mwis_search (rowid, {columns}) SELECT id, {columns} FROM mwis_all", cursor)
+
+    logger.info(f"Created search index over {cursor.rowcount} forecasts")
+
+
+def create_search_triggers(cursor, table: str, source: str, other_source: str) -> None:
+    """Triggers keeping mwis_search in sync with the table storing source's rows. source is the name rows
+    are read through (the table itself, or its view when src/compact_storage.py is enabled), and
+    other_source is the other of mwis and mwis_archive.
+    """
+    columns = ", ".join(SEARCH_FIELDS + ["location", "date", "days_ahead"])
+
+    # A row moved to the archive is already indexed. FTS5 cannot take the OR IGNORE conflict policy
+    # which the inserting statements pass down to triggers, so existing rows are skipped explicitly.
+    execute_query(f"""CREATE TRIGGER IF NOT EXISTS {table}_search_insert AFTER INSERT ON {table} BEGIN
+                      INSERT INTO mwis_search (rowid, {columns}) SELECT id, {columns} FROM {source}
+                      WHERE id = new.id AND NOT EXISTS (SELECT 1 FROM mwis_search WHERE rowid = new.id);
+                      END""", cursor)
+
+    # Moving a row to the archive inserts it there before deleting it from mwis, so only rows
+    # which are gone from both tables leave the index
+    execute_query(f"""CREATE TRIGGER IF NOT EXISTS {table}_search_delete AFTER DELETE ON {table} BEGIN
+                      DELETE FROM mwis_search WHERE rowid = old.id
+                      AND NOT EXISTS (SELECT 1 FROM {other_source} WHERE id = old.id);
+                      END""", cursor)
+
+
+def search_forecasts(query: str, fields: List[str] = None, location: str = None, limit: int = 20) -> List:
+    """Full-text search over all forecasts, best match first. query uses FTS5 syntax, e.g. '"freezing rain"'
+    for a phrase or 'thaw OR graupel', and can be restricted to some of SEARCH_FIELDS.
+    """
+    if fields:
+        unknown = set(fields) - set(SEARCH_FIELDS)
+        if unknown:
+            raise ValueError(f"Cannot search fields {unknown}, choose from {SEARCH_FIELDS}")
+
+        query = f"{{{' '.join(fields)}}} : ({query})"
+
+    db_path = database_cache_path()
+    assert db_path.exists()
+
+    with database_connection(db_path) as conn:
+        return run_query(conn, "search_forecasts", {"match": query, "location": location, "limit": limit})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-text search over all stored MWIS forecasts")
+    parser.add_argument("query", help="FTS5 query, e.g. thaw, '\"freezing rain\"' or 'graupel OR riming'")
+    parser.add_argument("--field", action="append", choices=SEARCH_FIELDS, help="Only search this field, can be repeated")
+    parser.add_argument("--location", default=None)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    for row in search_forecasts(args.query, args.field, args.location, args.limit):
+        print(f"{row['date']}  {row['location']:<30} day {row['days_ahead']}  {row['snippet']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,3 @@
-import sqlite3
 from pprint import pprint
 import re
 import string
@@ -7,6 +6,7 @@ from itertools import chain
 from pathlib import Path
 from dataclasses import dataclass
 
+from src.database_connection import connect
 from src.database_functions import execute_query
 from src.utils import database_cache_path
 
@@ -80,17 +80,19 @@ synonyms = {"flurry": "snow",
 
 
 def main():
-    conn = sqlite3.connect(str(database_cache_path()))
+    conn = connect(database_cache_path())
     cur = conn.cursor()
 
-    execute_query("SELECT how_wet FROM MWIS", cur)
+    execute_query("SELECT how_wet FROM mwis_all", cur)
     all_rain_fc = [x[0].lower() for x in cur.fetchall()]
+    conn.close()
 
 
     words = list(chain.from_iterable(x.split() for x in all_rain_fc))
 
 
-    nlp = spacy.load("en_core_web_md")
+    # Only lemmas, POS tags and the dependency parse are used below
+    nlp = spacy.load("en_core_web_md", exclude=["ner"])
 
     noun_counts = Counter()
     adj_counts = Counter()
@@ -99,8 +101,7 @@ def main():
     outdir = Path("dependency_parse/how_wet")
     outdir.mkdir(exist_ok=True, parents=True)
 
-    for text in all_rain_fc:
-        doc = nlp(text)
+    for doc in nlp.pipe(all_rain_fc, batch_size=256):
 
         # Write out svg image of dependecy parse
         #outfile = outdir / ("_".join(re.sub(r"[\W]", "", x.text) for x in doc if re.match(r"\w", x.text)) + ".svg")
@@ -159,8 +160,6 @@ def main():
                 if token.lemma_ in quantity_adjs.keys():
                     if token.dep_ in {"amod", "advmod", "conj"} and token.head == head_token:
                         modifiers.add(token.lemma_)
-                    else:
-                        #print(token, token.dep_, token.head, "head token=", head_token, "doc=", doc)
         else:
             # Just look for any modifier and add to token
             for token in doc:
@@ -208,16 +207,14 @@ def main():
 
 
 
-    for text in all_rain_fc:
+    # Sometimes the forecast text has a main section, followed by extra comments after a semicolon
+    # For simplicity just use the first statement
+    first_statements = [re.match(".*(?=;)", text)[0] if ";" in text else text for text in all_rain_fc]
+
+    for text, doc in zip(all_rain_fc, nlp.pipe(first_statements, batch_size=256)):
         print()
         print(text)
 
-        # Sometimes the forecast text has a main section, followed by extra comments after a semicolon
-        # For simplicity just use the first statement
-        if ";" in text:
-            text = re.match(".*(?=;)", text)[0]
-
-        doc = nlp(text)
         #for token in doc:
         #    print(f"{token.text}, {token.lemma_}, {token.pos_} ({spacy.explain(token.pos_)}), {token.tag_} ({spacy.explain(token.tag_)}), {token.dep_} ({spacy.explain(token.dep_)}) <- {token.head.text}")
 
@@ -0,0 +1,119 @@
+import argparse
+import logging
+from typing import Optional, Set, Tuple
+
+from src.database_connection import database_connection
+from src.database_functions import execute_query, execute_many_query
+from src.utils import database_cache_path, setup_logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# Increment whenever any of the text -> numeric conversions in src/web_app/mwis_utils.py change,
+# so that the backfill recomputes rows stored by the previous version
+PARSER_VERSION = 1
+
+NLP_BATCH_SIZE = 256  # how_wet texts per spaCy batch in a backfill
+
+
+FEATURE_COLUMNS = ["freezing_level_min",
+                   "freezing_level_max",
+                   "wind_min",
+                   "wind_max",
+                   "wind_directions",
+                   "cloud_free_min",
+                   "cloud_free_max",
+                   "rain_score",
+                   "snow_score"]
+
+
+def wind_directions_to_str(directions: Set[str]) -> str:
+    return ",".join(sorted(directions))
+
+
+def wind_directions_from_str(directions: str) -> Set[str]:
+    return set(directions.split(",")) if directions else set()
+
+
+def compute_features(freezing_level: str, how_windy: str, chance_cloud_free: str, precip: Optional[Tuple[int, int]]) -> Tuple:
+    """Numeric features for one forecast, in the order of FEATURE_COLUMNS. precip is the (rain, snow) scores
+    of its how_wet text from precip_scores_batch, which scores all the texts of a backfill in one go.
+    """
+    from src.web_app.mwis_utils import freezing_level_to_numeric, wind_to_numeric, get_wind_direction, cloud_to_numeric
+
+    # None if the scorer found no precipitation terms at all, stored as NULL rather than retried every backfill
+    rain_score, snow_score = precip if precip is not None else (None, None)
+
+    return (*freezing_level_to_numeric(freezing_level),
+            *wind_to_numeric(how_windy),
+            wind_directions_to_str(get_wind_direction(how_windy)),
+            *cloud_to_numeric(chance_cloud_free),
+            rain_score,
+            snow_score)
+
+
+def update_features(batch_size: int = NLP_BATCH_SIZE, n_process: int = 1) -> int:
+    """Compute features for every forecast which has none, or which has features from an older
+    PARSER_VERSION. Returns the number of rows computed. batch_size and n_process are passed to spaCy's
+    nlp.pipe for scoring the how_wet texts.
+    """
+    db_path = database_cache_path()
+    assert db_path.exists()
+
+    query = """SELECT m.id, m.freezing_level, m.how_windy, m.chance_cloud_free, m.how_wet
+               FROM mwis_all m LEFT JOIN mwis_features f ON f.mwis_id = m.id
+               WHERE f.mwis_id IS NULL OR f.parser_version != ?"""
+
+    with database_connection(db_path) as conn:
+        cursor = conn.cursor()
+
+        # Features of forecasts which have since been replaced, e.g. by a reparse of the page archive
+        execute_query("DELETE FROM mwis_features WHERE mwis_id NOT IN (SELECT id FROM mwis_all)", cursor)
+
+        execute_query(query, cursor, (PARSER_VERSION,))
+        rows = cursor.fetchall()
+
+        logger.info(f"Computing features for {len(rows)} forecasts")
+
+        if not rows:
+            return 0
+
+        # Imported here as this pulls in spaCy and loads the language model, which the scraper env may not have
+        from src.web_app.mwis_utils import precip_scores_batch
+
+        how_wet_texts = [how_wet for *_, how_wet in rows]
+        precip = precip_scores_batch(how_wet_texts, batch_size=batch_size, n_process=n_process)
+
+        for how_wet, scores in zip(how_wet_texts, precip):
+            if scores is None:
+                logger.warning(f"Could not score precipitation for: {how_wet}")
+
+        feature_rows = [(mwis_id, *compute_features(*texts[:3], scores), PARSER_VERSION)
+                        for (mwis_id, *texts), scores in zip(rows, precip)]
+
+        columns = ["mwis_id"] + FEATURE_COLUMNS + ["parser_version"]
+        insert = f"INSERT OR REPLACE INTO mwis_features ({','.join(columns)}) VALUES({','.join(['?'] * len(columns))})"
+        execute_many_query(insert, cursor, feature_rows)
+
+    return len(feature_rows)
+
+
+def main():
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Numeric features computed from MWIS forecast text")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subparsers.add_parser("backfill", help="Compute features for forecasts which are missing them or have stale ones")
+    backfill_parser.add_argument("--batch-size", type=int, default=NLP_BATCH_SIZE, help="Texts per spaCy batch")
+    backfill_parser.add_argument("--n-process", type=int, default=1, help="Processes parsing the texts")
+
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        num_rows = update_features(batch_size=args.batch_size, n_process=args.n_process)
+        logger.info(f"Backfilled features for {num_rows} forecasts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import argparse
+import datetime
+import logging
+
+from src.database_connection import database_connection
+from src.database_functions import execute_query
+from src.mwis_queries import run_scalar_query
+from src.utils import database_cache_path, setup_logging
+
+
+logger = logging.getLogger(__name__)
+
+
+SEASON_START_MONTH = 9  # Seasons run September to August, e.g. the 2022/23 season starts on 2022-09-01
+
+
+def season_start(date: datetime.date) -> datetime.date:
+    year = date.year if date.month >= SEASON_START_MONTH else date.year - 1
+    return datetime.date(year, SEASON_START_MONTH, 1)
+
+
+def archive_forecasts(today: datetime.date = None, seasons_to_keep: int = 1) -> int:
+    """Move rows out of the hot mwis table into mwis_archive, so that it only holds the latest forecast
+    per (location, date) for the most recent seasons. Returns the number of rows moved.
+
+    A forecast is only treated as superseded once its date has passed, as until then the scraper
+    could still see it on the MWIS site and would otherwise insert it again.
+    """
+    if today is None:
+        today = datetime.date.today()
+
+    cutoff = season_start(today)
+    for _ in range(seasons_to_keep - 1):
+        cutoff = season_start(cutoff - datetime.timedelta(days=1))
+
+    db_path = database_cache_path()
+    assert db_path.exists()
+
+    with database_connection(db_path) as conn:
+        cursor = conn.cursor()
+
+        execute_query("CREATE TEMP TABLE IF NOT EXISTS ids_to_archive (id integer PRIMARY KEY)", cursor)
+        execute_query("DELETE FROM ids_to_archive", cursor)
+
+        execute_query("""INSERT INTO ids_to_archive
+                         SELECT id FROM mwis WHERE date < :cutoff
+                         UNION
+                         SELECT m.id FROM mwis m WHERE m.date < :today AND EXISTS
+                           (SELECT 1 FROM mwis newer
+                            WHERE newer.location = m.location AND newer.date = m.date
+                            AND CAST(newer.days_ahead AS integer) < CAST(m.days_ahead AS integer))""",
+                      cursor, {"cutoff": str(cutoff), "today": str(today)})
+
+        num_moved = cursor.rowcount
+
+        execute_query("INSERT OR IGNORE INTO mwis_archive SELECT * FROM mwis WHERE id IN (SELECT id FROM ids_to_archive)", cursor)
+        execute_query("DELETE FROM mwis WHERE id IN (SELECT id FROM ids_to_archive)", cursor)
+
+        logger.info(f"Moved {num_moved} superseded or pre-{cutoff} forecasts to the archive table, "
+                    f"{run_scalar_query(conn, 'count_hot_forecasts')} rows remain in the hot table")
+
+    return num_moved
+
+
+def main():
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Database maintenance for the mwis tables")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    archive_parser = subparsers.add_parser("archive", help="Move superseded and old-season forecasts out of the hot table")
+    archive_parser.add_argument("--seasons-to-keep", type=int, default=1, help="Number of seasons, including the current one, kept in the hot table")
+
+    args = parser.parse_args()
+
+    if args.command == "archive":
+        archive_forecasts(seasons_to_keep=args.seasons_to_keep)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import sqlite3
+import logging
+import time
+from typing import Dict, List
+
+from src.database_connection import QueryError
+
+
+logger = logging.getLogger(__name__)
+
+
+# Log the duration of every query run through run_query, can also be set per call
+TIME_QUERIES = False
+
+
+class UnknownQueryError(QueryError):
+    """Raised when run_query is given a name which is not in QUERIES
+    """
+
+
+# Queries on mwis only see the hot table, the latest forecast per (location, date) for the current
+# season. Those on mwis_all also see the archive table, see src/mwis_maintenance.py.
+#
+# Every lookup is a fixed, parameterised SQL string. sqlite3 keeps compiled statements in a
+# per-connection cache keyed by the SQL text, so repeated calls on a connection skip compilation.
+QUERIES = {
+    "forecasts_for_location_date": """SELECT * FROM mwis_all
+                                      WHERE location = :location AND date = :date
+                                      ORDER BY id""",
+
+    "latest_forecast_per_date": """SELECT * FROM
+                                   (SELECT *, ROW_NUMBER() OVER (PARTITION BY location, date ORDER BY CAST(days_ahead AS integer)) AS rank
+                                    FROM mwis WHERE location = :location)
+                                   WHERE rank = 1
+                                   ORDER BY date""",
+
+    "forecasts_in_date_range": """SELECT * FROM mwis_all
+                                  WHERE date BETWEEN :start AND :end
+                                  ORDER BY location, date, days_ahead""",
+
+    "forecast_keys_in_date_range": """SELECT location, date, days_ahead FROM mwis_all
+                                      WHERE date BETWEEN :start AND :end""",
+
+    "forecasts_after_id": """SELECT * FROM mwis WHERE id > :after_id ORDER BY id""",
+
+    "all_forecasts": """SELECT * FROM mwis ORDER BY id""",
+
+    "hot_forecast_features": """SELECT * FROM mwis_features
+                                WHERE parser_version = :parser_version AND mwis_id IN (SELECT id FROM mwis)""",
+
+    "forecast_features_in_date_range": """SELECT * FROM mwis_features
+                                          WHERE parser_version = :parser_version
+                                          AND mwis_id IN (SELECT id FROM mwis_all WHERE date BETWEEN :start AND :end)""",
+
+    "latest_archived_date_before_hot": """SELECT MAX(date) FROM mwis_archive
+                                          WHERE date < COALESCE((SELECT MIN(date) FROM mwis), '9999-12-31')""",
+
+    "locations": """SELECT DISTINCT location FROM mwis ORDER BY location""",
+
+    "search_forecasts": """SELECT rowid AS id, location, date, days_ahead,
+                           snippet(mwis_search, -1, '[', ']', '...', 12) AS snippet
+                           FROM mwis_search
+                           WHERE mwis_search MATCH :match AND (:location IS NULL OR location = :location)
+                           ORDER BY rank
+                           LIMIT :limit""",
+
+    "count_forecasts": """SELECT COUNT(*) FROM mwis_all""",
+
+    "count_forecasts_per_location": """SELECT location, COUNT(*) FROM mwis_all GROUP BY location ORDER BY location""",
+
+    "count_hot_forecasts": """SELECT COUNT(*) FROM mwis""",
+}
+
+
+def run_query(conn: sqlite3.Connection, name: str, params: Dict = None, timed: bool = None) -> List[sqlite3.Row]:
+    """Run one of the named QUERIES with the given parameters. Rows can be indexed by position or column name.
+    """
+    if name not in QUERIES:
+        raise UnknownQueryError(f"No query named {name}")
+
+    if timed is None:
+        timed = TIME_QUERIES
+
+    start = time.perf_counter()
+
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+
+    try:
+        cursor.execute(QUERIES[name], params or {})
+        rows = cursor.fetchall()
+    except sqlite3.Error as e:
+        raise QueryError(f"Query {name} failed with params {params}: {e}") from e
+
+    if timed:
+        logger.info(f"Query {name} returned {len(rows)} rows in {1000 * (time.perf_counter() - start):.2f}ms")
+
+    return rows
+
+
+def run_scalar_query(conn: sqlite3.Connection, name: str, params: Dict = None, timed: bool = None):
+    """Run a named query which returns a single value, e.g. a count
+    """
+    return run_query(conn, name, params, timed)[0][0]
@@ -0,0 +1,137 @@
+import argparse
+import datetime
+import gzip
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Tuple
+
+from src.columnar_export import FORMAT_SUFFIXES, reset_export
+from src.database_connection import database_connection
+from src.database_functions import execute_query, add_mwis_forecast_to_database
+from src.mwis_forecast import MwisForecast
+from src.mwis_maintenance import archive_forecasts
+from src.utils import database_cache_path, mwis_archive_dir, mwis_export_dir, setup_logging, write_atomically
+
+
+logger = logging.getLogger(__name__)
+
+
+def archived_page_path(content_hash: str) -> Path:
+    """Pages are stored gzipped under their sha256, fanned out by the first two hex characters
+    """
+    return mwis_archive_dir() / content_hash[:2] / f"{content_hash}.html.gz"
+
+
+def archive_page(location: str, url: str, content: bytes, content_hash: str) -> None:
+    """Store raw page in the archive and record the fetch in the index. Identical pages are only stored once.
+    """
+    path = archived_page_path(content_hash)
+
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # A crash never leaves a truncated page under its hash
+        write_atomically(path, gzip.compress(content, compresslevel=9))
+
+        logger.debug(f"Archived new page for {location} at {path}")
+
+    db_path = database_cache_path()
+    assert db_path.exists()
+
+    with database_connection(db_path) as conn:
+        fetched_at = datetime.datetime.now().isoformat(timespec="seconds")
+        execute_query("INSERT INTO mwis_page_archive VALUES(?,?,?,?,?)", conn.cursor(), (None, location, url, fetched_at, content_hash))
+
+
+def load_archived_page(content_hash: str) -> bytes:
+    return gzip.decompress(archived_page_path(content_hash).read_bytes())
+
+
+def get_archived_pages() -> List[Tuple[str, str]]:
+    """Get (location, content_hash) for each distinct archived page, in the order they were first fetched
+    """
+    db_path = database_cache_path()
+    assert db_path.exists()
+
+    query = """SELECT location, content_hash, MIN(fetched_at) AS first_fetched_at
+               FROM mwis_page_archive
+               GROUP BY location, content_hash
+               ORDER BY first_fetched_at"""
+
+    with database_connection(db_path) as conn:
+        cursor = conn.cursor()
+        execute_query(query, cursor)
+
+        return [(location, content_hash) for location, content_hash, _ in cursor.fetchall()]
+
+
+def parse_archived_page(page: Tuple[str, str]) -> List[MwisForecast]:
+    """Run the extraction code on one archived page. Runs in a worker process.
+    """
+    # Imported here so that archiving from the scraper does not create a circular import
+    from src.scrape_latest_mwis import extract_forecasts_for_area
+
+    location, content_hash = page
+    forecasts = []
+
+    try:
+        extract_forecasts_for_area(location, load_archived_page(content_hash), forecasts)
+    except Exception as e:
+        logger.error(f"Failed to parse archived page {content_hash} for {location}: {e}")
+        return []
+
+    return forecasts
+
+
+def reparse_archive(max_workers: int = None) -> None:
+    """Rebuild the mwis table from the archived pages with the current extraction code.
+
+    Rows which can be reproduced from the archive are replaced, rows from before the archive
+    existed are left as they are. Replaced rows get new ids, so the columnar exports in the default
+    directories are reset and the next export writes every row again. Exports elsewhere need --reset.
+    """
+    start = time.time()
+
+    pages = get_archived_pages()
+
+    logger.info(f"Reparsing {len(pages)} archived pages")
+
+    all_forecasts = []
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        for forecasts in pool.map(parse_archived_page, pages, chunksize=16):
+            all_forecasts.extend(forecasts)
+
+    logger.info(f"Extracted {len(all_forecasts)} forecasts in {time.time() - start:.2f}s")
+
+    add_mwis_forecast_to_database(all_forecasts, replace_existing=True)
+
+    # Rebuilt rows all land in the hot table, move the superseded ones back out
+    archive_forecasts()
+
+    # The exports hold the replaced rows under their old ids, which the high water mark has already passed
+    for fmt in FORMAT_SUFFIXES:
+        reset_export(mwis_export_dir() / fmt)
+
+    logger.info(f"Rebuilt mwis table in {time.time() - start:.2f}s")
+
+
+def main():
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Raw MWIS page archive")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    reparse_parser = subparsers.add_parser("reparse", help="Rebuild the mwis table from archived pages, without network access")
+    reparse_parser.add_argument("--workers", type=int, default=None, help="Number of parser processes (default: number of CPUs)")
+
+    args = parser.parse_args()
+
+    if args.command == "reparse":
+        reparse_archive(args.workers)
+
+
+if __name__ == "__main__":
+    main()
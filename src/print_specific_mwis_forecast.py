@@ -1,7 +1,7 @@
 import datetime
-import sqlite3
 
-from src.database_functions import execute_query
+from src.database_connection import database_connection
+from src.mwis_queries import run_query
 from src.utils import database_cache_path
 
 def main():
@@ -12,12 +12,10 @@ def main():
     db_path = database_cache_path()
     assert db_path.exists()
 
-    conn = sqlite3.connect(str(db_path))
-    cursor = conn.cursor()
+    with database_connection(db_path) as conn:
+        rows = run_query(conn, "forecasts_for_location_date", {"location": location, "date": date})
 
-    execute_query(f"SELECT * FROM mwis WHERE (date='{date}' AND location='{location}')", cursor)
-
-    print(cursor.fetchall()[-1])
+        print(tuple(rows[-1]))
 
 
 if __name__ == "__main__":
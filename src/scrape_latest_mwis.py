@@ -1,20 +1,22 @@
 import re
+import hashlib
 from typing import Dict, List
 import os
 from pathlib import Path
 from typing import *
 from dateutil.parser import parse
 import datetime
-import requests
 import logging
 from pprint import pformat
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, NavigableString, Tag
 import pandas as pd
 
-from src.database_functions import setup_database, add_mwis_forecast_to_database
+from src.database_functions import setup_database, add_mwis_forecast_to_database, load_fetch_state, save_fetch_state
+from src.fetch_functions import fetch_pages, conditional_headers
 from src.mwis_forecast import MwisForecast
-from src.utils import mwis_log_dir
+from src.page_archive import archive_page
+from src.utils import mwis_log_dir, setup_logging
 
 
 logger = logging.getLogger(__name__)
@@ -23,6 +25,16 @@ logger = logging.getLogger(__name__)
 URL_BASE = 'https://www.mwis.org.uk/forecasts/scottish/'
 
 
+# BeautifulSoup tree builder used for forecast pages. 'lxml' parses several times faster, see
+# src/benchmark_mwis_extract.py to check that it gives identical output on archived pages first
+HTML_PARSER = 'html.parser'
+
+
+FORECAST_IDS = {'Forecast0', 'Forecast1', 'Forecast2'}
+
+DATE_MARKER = 'Viewing Forecast For'
+
+
 LOCATIONS = ['west-highlands',
              'the-northwest-highlands',
              'cairngorms-np-and-monadhliath',
@@ -33,55 +45,179 @@ def main():
     logdir = mwis_log_dir()
     if not logdir.exists():
         logdir.mkdir(parents=True)
-    logging.basicConfig(handlers=[logging.FileHandler(filename=logdir / f"run_{datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}.log", mode="w"),
-        logging.StreamHandler()], 
-        level=logging.DEBUG,
-        format="[%(asctime)s-%(filename)s-%(levelname)s] %(message)s")
+    setup_logging(logging.DEBUG, logdir / f"run_{datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}.log")
 
     logger.info("Started main script")
 
     setup_database()
+
+    fetch_state = load_fetch_state()
+    previous_fetch_state = dict(fetch_state)
     
-    mwis_forecast = scrape_latest_mwis()
+    mwis_forecast = scrape_latest_mwis(fetch_state)
 
     logger.debug(pformat(mwis_forecast, width=240))
 
-    add_mwis_forecast_to_database(mwis_forecast)
+    if mwis_forecast:
+        add_mwis_forecast_to_database(mwis_forecast)
+    else:
+        logger.info("No new forecasts, database not touched")
 
-    logger.info("Program finished normally")
+    save_fetch_state({url: state for url, state in fetch_state.items() if previous_fetch_state.get(url) != state})
 
+    # Features and pre-rendered charts need the NLP and plotting stack, which the scraper env does not have.
+    # They are updated by a separate cron job in the full env, see `make derived-data-cronjob`.
+    logger.info("Program finished normally")
 
 
-def scrape_latest_mwis() -> List[MwisForecast]:
+def scrape_latest_mwis(fetch_state: Dict[str, Dict] = None) -> List[MwisForecast]:
     """Top level function in this module, scrapes latest MWIS forecast
+
+    fetch_state maps each URL to the validators and body hash from its previous fetch. Regions
+    whose page has not changed since then are skipped, and the state is updated in place for
+    regions which were parsed successfully.
     """
-    URLs = [URL_BASE + x + '/text' for x in LOCATIONS]
-    
-    pages = [requests.get(x) for x in URLs]
-    
-    for x in pages:
-        # Check that request has succeeded
-        assert x.status_code == 200
-    
-    logger.info('Successfully fetched latest forecasts')
+    if fetch_state is None:
+        fetch_state = {}
+
+    URLs = {l: URL_BASE + l + '/text' for l in LOCATIONS}
+
+    # Regions are fetched concurrently, a failed region maps to None
+    headers = {url: conditional_headers(fetch_state.get(url, {})) for url in URLs.values()}
+    pages = fetch_pages(list(URLs.values()), headers)
+
+    failed = [l for l, url in URLs.items() if pages[url] is None]
+
+    logger.info(f'Fetched latest forecasts for {len(URLs) - len(failed)}/{len(URLs)} regions')
 
     all_forecasts = []
-    
-    for l, p in zip(LOCATIONS, pages):
-        extract_forecasts_for_area(l, p, all_forecasts)
+    unchanged = []
+
+    for l, url in URLs.items():
+        page = pages[url]
+
+        if page is None:
+            continue
+
+        if page.status_code == 304:
+            unchanged.append(l)
+            continue
+
+        content_hash = hashlib.sha256(page.content).hexdigest()
+        new_state = {"etag": page.headers.get("ETag"),
+                     "last_modified": page.headers.get("Last-Modified"),
+                     "content_hash": content_hash}
+
+        if content_hash == fetch_state.get(url, {}).get("content_hash"):
+            # Server ignored the conditional request but the body is the same
+            unchanged.append(l)
+            fetch_state[url] = new_state
+            continue
+
+        # Archive before parsing, so pages which the parser chokes on can be reparsed later
+        archive_page(l, url, page.content, content_hash)
+
+        # Parse into a separate list so that a region which fails part way through adds nothing
+        area_forecasts = []
+
+        try:
+            extract_forecasts_for_area(l, page.content, area_forecasts)
+        except Exception as e:
+            logger.error(f'Failed to parse forecast for {l}: {e}')
+            failed.append(l)
+            continue
+
+        all_forecasts.extend(area_forecasts)
+        fetch_state[url] = new_state
+
+    if failed:
+        logger.warning(f'No forecasts stored for regions: {failed}')
+
+    logger.info(f'{len(unchanged)}/{len(URLs)} regions unchanged since last run and short-circuited: {unchanged}')
 
     logger.info('HTML page parsed successfully')
 
     return all_forecasts
 
 
-def extract_forecasts_for_area(location: str, page: requests.Response, all_forecasts: List) -> None:
-    """Get all three forecasts for given area
+def extract_forecasts_for_area(location: str, content: bytes, all_forecasts: List, parser: str = None) -> None:
+    """Get all three forecasts for given area from the raw page
     """
-    soup = BeautifulSoup(page.content, 'html.parser')
+    soup = BeautifulSoup(content, parser or HTML_PARSER)
+
+    forecast_soups = {}
+    h1 = None
+
+    # Locate the three forecast blocks and the page title in one walk of the tree
+    for el in soup.descendants:
+        if isinstance(el, Tag):
+            if h1 is None and el.name == 'h1':
+                h1 = el
+            if el.get('id') in FORECAST_IDS and el['id'] not in forecast_soups:
+                forecast_soups[el['id']] = el
 
     for i in range(3):
-        all_forecasts.append(extract_forecast_for_day(location, i, soup, all_forecasts))
+        # Headline only exists for next day forecast
+        headline = f"Headline for {h1.text}" if i == 0 else None
+        forecast_soup = forecast_soups.get('Forecast' + str(i))
+        all_forecasts.append(extract_forecast_for_day_single_pass(location, i, forecast_soup, headline))
+
+
+def extract_forecast_for_day_single_pass(location: str, i: int, forecast_soup: Tag, headline: str = None) -> MwisForecast:
+    """Equivalent to extract_forecast_for_day, but maps every h4 heading to its section in one
+    walk of the forecast block, rather than one search from the top of the block per section.
+    """
+    forecast = MwisForecast()
+    forecast.location = location
+    forecast.days_ahead = i + 1
+
+    title_to_attr = {title: k for k, title in MwisForecast.attr_to_section_title().items()}
+    if headline is not None:
+        title_to_attr[headline] = 'headline'
+
+    sections = {}
+    awaiting_div = []  # Attributes whose h4 has been seen, waiting for the following div
+    awaiting_tag = []  # Attributes whose div has been seen, the next tag holds the section text
+    seen_titles = set()
+    date_tags = None  # Tags following the date marker string, the date is in the second
+
+    for el in (forecast_soup.descendants if forecast_soup is not None else []):
+        if isinstance(el, NavigableString):
+            if date_tags is None and el == DATE_MARKER:
+                date_tags = []
+            continue
+
+        if date_tags is not None and len(date_tags) < 2:
+            date_tags.append(el)
+
+        for k in awaiting_tag:
+            sections[k] = re.sub(r'\s+', ' ', el.text)
+        awaiting_tag = []
+
+        if el.name == 'div':
+            awaiting_tag = awaiting_div
+            awaiting_div = []
+
+        if el.name == 'h4':
+            title = el.string
+            if title in title_to_attr and title not in seen_titles:
+                seen_titles.add(title)
+                awaiting_div.append(title_to_attr[title])
+
+    for title, k in title_to_attr.items():
+        if k in sections:
+            setattr(forecast, k, sections[k])
+        else:
+            # Missing from this block, or the section runs past the end of it
+            setattr(forecast, k, extract_forecast_section(forecast_soup, title))
+
+    if date_tags is not None and len(date_tags) == 2:
+        datestr = date_tags[1].text.split('\n')[3]
+    else:
+        datestr = forecast_soup.find(text=DATE_MARKER).findNext().findNext().text.split('\n')[3]
+    forecast.date = str(parse(datestr).date())
+
+    return forecast
 
 
 def extract_forecast_for_day(location: str, i: int, soup: BeautifulSoup, all_forecasts: List) -> MwisForecast:
@@ -122,8 +258,7 @@ def extract_forecast_section(forecast_soup, title) -> str:
         return forecast_str
 
     except Exception as e:
-        print("Problem with ", x)
-        print("Exception: ", e)
+        logger.warning(f"Problem with section {title}: {e}")
         return ""
 
 
@@ -1,8 +1,54 @@
+import logging
+import os
+import tempfile
 from pathlib import Path
 
 
+LOG_FORMAT = "[%(asctime)s-%(filename)s-%(levelname)s] %(message)s"
+
+
+def setup_logging(level: int = logging.INFO, log_file: Path = None) -> None:
+    """Log to the console, and to log_file as well if given, in the format every entry point uses
+    """
+    handlers = [logging.StreamHandler()]
+    if log_file is not None:
+        handlers.insert(0, logging.FileHandler(filename=log_file, mode="w"))
+
+    logging.basicConfig(handlers=handlers, level=level, format=LOG_FORMAT)
+
+
+def write_atomically(path: Path, data: bytes) -> None:
+    """Write to a temporary file in the same directory and rename it into place, so that readers and a
+    crash part way through never leave a partial file under path
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+
 def database_cache_path() -> Path:
     return Path.home() / ".scottish-winter-coding/data.db"
 
 def mwis_log_dir() -> Path:
     return Path.home() / ".scottish-winter-coding/log"
+
+def mwis_archive_dir() -> Path:
+    return Path.home() / ".scottish-winter-coding/archive"
+
+def mwis_export_dir() -> Path:
+    return Path.home() / ".scottish-winter-coding/export"
+
+def mwis_chart_dir() -> Path:
+    return Path.home() / ".scottish-winter-coding/charts"
+
+def nlp_score_cache_path() -> Path:
+    return Path.home() / ".scottish-winter-coding/nlp_scores.db"
+
+def mwis_metrics_dir() -> Path:
+    return Path.home() / ".scottish-winter-coding/metrics"
@@ -1,21 +1,251 @@
-from flask import Flask, render_template, send_file
+import contextvars
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Callable, Tuple
 
-from src.web_app.charts import get_main_image
+from flask import Flask, Response, abort, g, render_template, request
+
+from src.utils import setup_logging
+from src.web_app.chart_data import get_chart_data
+from src.web_app.charts import PANELS, RENDER_VERSION, chart_window, get_panel_image, stack_images
+from src.web_app.metrics import CACHE_LOOKUPS, REQUEST_SECONDS, REQUESTS, StageTimes, current_stage_times, exposition, stage
+from src.web_app.mwis_database import forecast_cache
+from src.web_app.prerender import load_prerendered
+from src.web_app.render_cache import CachedImage, RenderCache
+from src.web_app.render_pool import RenderPool, RenderPoolFull
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+render_cache = RenderCache()
+render_pool = RenderPool()
+
+# Threads which wait for panel renders, so that the panels of one image are rendered side by side
+panel_requests = ThreadPoolExecutor(max_workers=16, thread_name_prefix="panels")
+
+GZIP_LEVEL = 6
+
+# Values of ?days and ?season which chart_window can turn into dates: up to ten years back, and seasons
+# which end before datetime.MAXYEAR does
+DAYS_RANGE = (1, 3660)
+SEASON_RANGE = (1900, 9998)
+
+
+def render_panel_image(panel, snapshot, start, end, locations) -> bytes:
+    return get_panel_image(panel, snapshot, start, end, locations).getvalue()
+
+
+def render_stacked_image(images) -> bytes:
+    return stack_images(images).getvalue()
+
+
+def panel_key(panel, snapshot, start, end, locations) -> tuple:
+    return ("panel", panel, snapshot.version, start, end, tuple(locations or ()))
+
+
+def main_key(snapshot, start, end, locations) -> tuple:
+    return ("main", snapshot.version, start, end, tuple(locations or ()))
+
+
+def panel_image(panel, snapshot, start, end, locations) -> CachedImage:
+    return render_cache.get(panel_key(panel, snapshot, start, end, locations),
+                            lambda: render_pool.render(render_panel_image, panel, snapshot, start, end, locations))
+
+
+def main_image_from_panels(snapshot, start, end, locations) -> bytes:
+    """The main image, stacked from panels which are rendered in parallel or already cached"""
+    futures = [panel_requests.submit(contextvars.copy_context().run, panel_image, panel, snapshot, start, end, locations)
+               for panel in PANELS]
+    panels = [future.result() for future in futures]
+
+    return render_pool.render(render_stacked_image, [panel.data for panel in panels])
+
+
+def chart_etag(key: tuple) -> str:
+    """Strong ETag for the chart with this render cache key. The key holds the data version and the chart's
+    arguments, so the ETag is known before rendering and is the same in every worker process. RENDER_VERSION
+    changes it when a deploy draws the same data differently."""
+    return hashlib.sha256(repr((RENDER_VERSION, key)).encode()).hexdigest()
+
+
+def image_response(key: tuple, get_image: Callable[[], CachedImage]) -> Response:
+    """PNG response with the chart's ETag. A browser which already has the image gets a 304 without it being
+    rendered, so a worker with a cold cache can answer revalidations straight away."""
+    etag = chart_etag(key)
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(get_image().data, mimetype='image/png')
+
+    response.set_etag(etag)
+
+    # Browsers revalidate on every view, which only costs a 304 until the scraper adds rows
+    response.cache_control.no_cache = True
+    return response
+
+
+def json_response(payload) -> Response:
+    """Compact JSON, gzipped if the client accepts it, with an ETag so unchanged data costs a 304"""
+    with stage("serialise"):
+        body = json.dumps(payload, separators=(",", ":")).encode()
+        etag = hashlib.sha256(body).hexdigest()
+
+        if request.accept_encodings["gzip"]:
+            # mtime=0 keeps the compressed bytes the same for the same data
+            response = Response(gzip.compress(body, GZIP_LEVEL, mtime=0), mimetype='application/json')
+            response.content_encoding = 'gzip'
+
+            # Strong validators must differ between encodings of the same data
+            etag += '-gzip'
+        else:
+            response = Response(body, mimetype='application/json')
+
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def date_arg(name: str):
+    value = request.args.get(name)
+    if value is None:
+        return None
+
+    try:
+        return str(datetime.date.fromisoformat(value))
+    except ValueError:
+        abort(400, f"{name} must be a date such as 2023-01-31, not {value}")
+
+
+def int_arg(name: str, valid_range: Tuple[int, int]):
+    value = request.args.get(name)
+    if value is None:
+        return None
+
+    try:
+        number = int(value)
+    except ValueError:
+        abort(400, f"{name} must be a whole number, not {value}")
+
+    low, high = valid_range
+    if not low <= number <= high:
+        abort(400, f"{name} must be from {low} to {high}, not {value}")
+
+    return number
+
+
+def locations_arg(snapshot):
+    """Locations from a comma separated list, or None for all of them"""
+    if not request.args.get('locations'):
+        return None
+
+    locations = request.args['locations'].split(',')
+    unknown = set(locations) - set(snapshot.locations)
+    if unknown:
+        abort(400, f"Unknown locations {sorted(unknown)}, choose from {snapshot.locations}")
+
+    return locations
+
+
+def chart_args(snapshot):
+    """(start, end, locations, snapshot) for a chart request, see main_image. Windows such as ?days=7 count back
+    from the latest forecast rather than the calendar date, so they match the pre-rendered charts. The snapshot
+    is the one given, unless the window reaches back into the archive table."""
+    start, end = chart_window(int_arg('days', DAYS_RANGE), int_arg('season', SEASON_RANGE), date_arg('start'), date_arg('end'),
+                              today=snapshot.issue_date())
+    return start, end, locations_arg(snapshot), forecast_cache.window_snapshot(snapshot, start, end)
+
+
+@app.before_request
+def start_request_timing():
+    g.start_time = time.perf_counter()
+    g.stage_times = StageTimes()
+    g.stage_times_token = current_stage_times.set(g.stage_times)
+
+
+@app.after_request
+def record_request(response):
+    """Count and time the request, and log it as one JSON line with the time spent in each stage"""
+    duration = time.perf_counter() - g.start_time
+    endpoint = request.endpoint or "unmatched"
+
+    REQUESTS.inc(endpoint, str(response.status_code))
+    REQUEST_SECONDS.observe(duration, endpoint)
+
+    logger.info(json.dumps({"endpoint": endpoint, "path": request.full_path.rstrip("?"), "status": response.status_code,
+                            "duration_ms": round(1000 * duration, 2), "stages_ms": g.stage_times.as_ms()}))
+    return response
+
+
+@app.teardown_request
+def end_request_timing(exc):
+    if "stage_times_token" in g:
+        current_stage_times.reset(g.stage_times_token)
+
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics for this process, or added up over every worker when run with gunicorn_conf.py"""
+    return Response(exposition(), mimetype='text/plain; version=0.0.4')
+
 
 @app.route('/')
 def main():
     """Entry point; the view for the main page"""
-    return render_template('main.html')
+    return render_template('main.html', panels=list(PANELS))
 
 
 @app.route('/main_image.png')
 def main_image():
-    img = get_main_image()
-    return send_file(img, mimetype='image/png', cache_timeout=0)
+    """Chart for ?days=30, ?season=2022 (starting September 2022) or ?start=2023-01-01&end=2023-01-31, by default the current season.
+    ?locations=west-highlands,... limits it to some regions."""
+    start, end, locations, snapshot = chart_args(forecast_cache.snapshot())
+    key = main_key(snapshot, start, end, locations)
+
+    def get_image() -> CachedImage:
+        # The standard charts are pre-rendered after each scrape, anything else is rendered here
+        image = load_prerendered(snapshot, start, end, locations)
+        if image is not None:
+            CACHE_LOOKUPS.inc("prerendered")
+            return image
+
+        return render_cache.get(key, lambda: main_image_from_panels(snapshot, start, end, locations))
+
+    return image_response(key, get_image)
+
+
+@app.route('/charts/<panel>.png')
+def panel_chart(panel):
+    """One panel of the main image, e.g. /charts/freezing_level.png, taking the same parameters"""
+    if panel not in PANELS:
+        abort(404, f"No panel named {panel}, choose from {list(PANELS)}")
+
+    *args, snapshot = chart_args(forecast_cache.snapshot())
+    return image_response(panel_key(panel, snapshot, *args), lambda: panel_image(panel, snapshot, *args))
+
+
+@app.errorhandler(RenderPoolFull)
+@app.errorhandler(TimeoutError)
+def render_unavailable(e):
+    """The render queue is full or a render is taking too long, ask the client to come back shortly"""
+    return Response("Charts are busy, try again shortly", status=503, headers={'Retry-After': '10'}, mimetype='text/plain')
+
+
+@app.route('/api/chart_data')
+def chart_data():
+    """Chart series as JSON, for ?start=2023-01-01&end=2023-01-31&locations=west-highlands,cairngorms-np-and-monadhliath"""
+    snapshot = forecast_cache.snapshot()
+    start, end, locations = date_arg('start'), date_arg('end'), locations_arg(snapshot)
+    return json_response(get_chart_data(forecast_cache.window_snapshot(snapshot, start, end), start, end, locations))
 
 
 if __name__ == '__main__':
+    setup_logging()
     app.run()
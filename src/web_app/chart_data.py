@@ -0,0 +1,43 @@
+import logging
+from typing import Dict, List, Optional
+
+from src.web_app.charts import SERIES_PREPARATION, prepared_series, window_series
+from src.web_app.mwis_database import ForecastSnapshot
+
+
+logger = logging.getLogger(__name__)
+
+
+COMPASS_POINTS = ["N", "NE", "E", "SE", "S", "SW", "W", "NW"]
+
+
+def encode_value(series: str, value):
+    """JSON-friendly value: (min, max) ranges become lists and wind directions a string such as "SW W"
+    """
+    if series == "wind_direction":
+        return " ".join(d for d in COMPASS_POINTS if d in value)
+
+    if isinstance(value, tuple):
+        return list(value)
+
+    return value
+
+
+def get_chart_data(snapshot: ForecastSnapshot, start: Optional[str] = None, end: Optional[str] = None,
+                   locations: Optional[List[str]] = None) -> Dict:
+    """Prepared series for dates from start to end inclusive (ISO dates, either can be left open) and the
+    given locations, or all of them. Each location lists its dates once, with one value per date in each
+    series, rather than repeating the date against every value.
+    """
+    data = window_series(prepared_series(snapshot), start, end)
+
+    if locations is None:
+        locations = snapshot.locations
+
+    result = {}
+    for loc in locations:
+        result[loc] = {"dates": data[loc]["dates"]}
+        for name in SERIES_PREPARATION:
+            result[loc][name] = [encode_value(name, v) for v in data[loc][name]]
+
+    return {"version": snapshot.version, "series": list(SERIES_PREPARATION), "locations": result}
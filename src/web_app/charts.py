@@ -1,56 +1,125 @@
+import bisect
+import datetime
+import statistics
+import threading
+from collections import OrderedDict
 from io import BytesIO
 from pprint import pprint
-
-import matplotlib.pyplot as plt
-from src.web_app.mwis_database import data, LOCATIONS, get_raw_forecasts
+from typing import Callable, Dict, List, Optional, Tuple
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import numpy as np
+from matplotlib.figure import Figure
+from PIL import Image
+from src.mwis_features import wind_directions_from_str
+from src.mwis_maintenance import season_start
+from src.web_app.metrics import stage
+from src.web_app.mwis_database import ForecastSnapshot, forecast_cache
 from src.web_app.mwis_utils import freezing_level_to_numeric, cloud_to_numeric, wind_to_numeric, get_wind_direction, how_wet_to_numeric, how_snowy_to_numeric
 
 
-def get_main_image():
+DAILY_POINTS_LIMIT = 90  # Longer windows are plotted as weekly summaries
+INCHES_PER_POINT = 0.5
+MIN_FIGURE_WIDTH = 8
+MAX_FIGURE_WIDTH = 30  # Render time and PNG size stay bounded however much history there is
+PANEL_HEIGHT = 4
+
+# Part of every chart's ETag and pre-render key. Bump it when a code change alters the images, e.g. the
+# plotting or the precipitation rules in mwis_utils, so browsers and pre-rendered charts are not kept.
+RENDER_VERSION = 1
+
+
+def get_main_image(snapshot: ForecastSnapshot = None, start: Optional[str] = None, end: Optional[str] = None,
+                   locations: Optional[List[str]] = None):
+    """Chart of the forecasts dated from start to end inclusive (ISO dates, either can be left open) for the
+    given locations, or all of them: every panel in PANELS, one above the other. Windows of more than
+    DAILY_POINTS_LIMIT days show the weekly range as shading and the median of the daily values as a line.
+    """
+    # Every panel uses the same snapshot, even if the scraper adds rows part way through
+    if snapshot is None:
+        snapshot = forecast_cache.snapshot()
+
+    panels = [get_panel_image(panel, snapshot, start, end, locations).getvalue() for panel in PANELS]
+    return stack_images(panels)
+
+
+def get_panel_image(panel: str, snapshot: ForecastSnapshot = None, start: Optional[str] = None,
+                    end: Optional[str] = None, locations: Optional[List[str]] = None):
+    """One of the PANELS on its own, as a PNG the full width of the main image
+    """
+    if snapshot is None:
+        snapshot = forecast_cache.snapshot()
+    if locations is None:
+        locations = snapshot.locations
+
+    series = prepared_series(snapshot, PANEL_SERIES[panel])
+
+    with stage("summarise"):
+        data = window_series(series, start, end)
+
+        num_days = len(set(d for loc in locations for d in data[loc]["dates"]))
+        weekly = num_days > DAILY_POINTS_LIMIT
+        data = {loc: summarise_series(data[loc], weekly) for loc in locations}
 
-    freezing_level_data = freezing_level_data_preparation()
-    wind_data = wind_data_preparation()
-    wind_dir_data = wind_direction_preparation()
-    cloud_data = cloud_data_preparation()
-    rain_data = rain_data_preparation()
-    snow_data = snow_data_preparation()
+    num_points = len(set(d for loc in locations for d in data[loc]["dates"]))
+    width = min(max(num_points * INCHES_PER_POINT, MIN_FIGURE_WIDTH), MAX_FIGURE_WIDTH)
 
-    num_dates = len(freezing_level_data["west-highlands"][1])
+    # A Figure of its own rather than pyplot's global current figure, so concurrent renders in
+    # different threads cannot draw into each other's axes. It is not registered with pyplot, so it is
+    # freed once this function returns instead of staying open until closed.
+    with stage("draw"):
+        fig = Figure(figsize=(width, PANEL_HEIGHT), dpi=120)
+        canvas = FigureCanvasAgg(fig)
+        ax = fig.subplots()
 
+        PANELS[panel](ax, data, locations, weekly)
+        ax.tick_params(axis="x", labelrotation=45)
 
-    plt.clf()
-    fig, axs = plt.subplots(4, 1, figsize=(num_dates * 0.5, 16), dpi=120)
+        if weekly and panel == next(iter(PANELS)):
+            ax.set_title("Weekly range of the daily forecasts, with the median day")
 
-    # Plot freezing level
-    ax = axs[0]
+        fig.tight_layout()
+        canvas.draw()
+
+    # Encoded from the drawn pixels, as fig.savefig would draw the figure again
+    with stage("encode"):
+        img = BytesIO()
+        Image.fromarray(np.asarray(canvas.buffer_rgba())).save(img, format="png")
+
+    img.seek(0)
+    return img
+
+
+def stack_images(images: List[bytes]) -> BytesIO:
+    """PNG of the images one above the other, which all have the same width"""
+    with stage("stack"):
+        panels = [Image.open(BytesIO(image)) for image in images]
+
+        stacked = Image.new("RGBA", (panels[0].width, sum(p.height for p in panels)))
+        y = 0
+        for panel in panels:
+            stacked.paste(panel, (0, y))
+            y += panel.height
+
+        img = BytesIO()
+        stacked.save(img, format="png")
+
+    img.seek(0)
+    return img
+
+
+def plot_freezing_level(ax, data: Dict, locations: List[str], weekly: bool) -> None:
     ax.set_ylim(0, 1500)
     ax.axhline(900, ls="--", c="black", alpha=0.5)
-    for loc in LOCATIONS:
-        x = freezing_level_data[loc][1]
-        ymin = [w[0] for w in freezing_level_data[loc][0]]
-        ymax = [w[1] for w in freezing_level_data[loc][0]]
-        y_mean = [0.5*(w[0]+w[1]) for w in freezing_level_data[loc][0]]
-        y_err = [w[1] - wmean for w, wmean in zip(freezing_level_data[loc][0], y_mean)]
-        ax.fill_between(x, ymin, ymax, alpha=0.2)
-        ax.errorbar(x, y_mean, yerr=y_err, capsize=5, marker="o", label=loc)
-        ax.set_ylabel("Freezing level (m)")
-        ax.set_xticklabels(x, rotation=45)
-
+    plot_ranges(ax, data, locations, "freezing_level", weekly)
+    ax.set_ylabel("Freezing level (m)")
     ax.legend()
 
-    # Plot wind data
-    ax = axs[1]
+
+def plot_wind(ax, data: Dict, locations: List[str], weekly: bool) -> None:
     ax.set_ylim(0, 100)
-    for loc in LOCATIONS:
-        x = wind_data[loc][1]
-        ymin = [w[0] for w in wind_data[loc][0]]
-        ymax = [w[1] for w in wind_data[loc][0]]
-        y_mean = [0.5*(w[0]+w[1]) for w in wind_data[loc][0]]
-        y_err = [w[1] - wmean for w, wmean in zip(wind_data[loc][0], y_mean)]
-        ax.fill_between(x, ymin, ymax, alpha=0.2)
-        ax.errorbar(x, y_mean, yerr=y_err, capsize=5, marker="o", label=loc)
-        ax.set_ylabel("Wind speed (mph)")
-        ax.set_xticklabels(x, rotation=45)
+    plot_ranges(ax, data, locations, "wind_speed", weekly)
+    ax.set_ylabel("Wind speed (mph)")
     ax.legend()
 
     # Add wind direction
@@ -61,9 +130,9 @@ def get_main_image():
     ax2.set_yticks(y_vals, yticks)
     ax2.set_yticklabels(yticks)
 
-    for loc in LOCATIONS:
-        xs = wind_dir_data[loc][1]
-        ys = wind_dir_data[loc][0]
+    for loc in locations:
+        xs = data[loc]["dates"]
+        ys = data[loc]["wind_direction"]
 
         x_extended = []
         y_extended = []
@@ -77,105 +146,230 @@ def get_main_image():
     ax2.set_ylabel("Wind direction")
 
 
-    # Plot cloud data
-    ax = axs[2]
+def plot_cloud(ax, data: Dict, locations: List[str], weekly: bool) -> None:
     ax.set_ylim(0, 100)
-    for loc in LOCATIONS:
-        x = cloud_data[loc][1]
-        y_min = [w[0] for w in cloud_data[loc][0]]
-        y_max = [w[1] for w in cloud_data[loc][0]]
-        y_mean = [0.5*(w[0]+w[1]) for w in cloud_data[loc][0]]
-        y_err = [w[1] - 0.5*(w[0]+w[1]) for w in cloud_data[loc][0]]
-        ax.fill_between(x, y_min, y_max, alpha=0.2)
-        ax.errorbar(x, y_mean, yerr=y_err, label=loc, marker="o", capsize=5)
-        ax.set_ylabel("% cloud free")
-        ax.set_xticklabels(x, rotation=45)
+    plot_ranges(ax, data, locations, "cloud_free", weekly)
+    ax.set_ylabel("% cloud free")
     ax.legend()
 
-    # Plot rain and snow data
-    ax = axs[3]
+
+def plot_precipitation(ax, data: Dict, locations: List[str], weekly: bool) -> None:
     ax.set_ylim(0, 6)
     ax.set_yticks(range(6))
     ax.set_yticklabels(["dry", "light", "intermittent", "constant", "heavy", "very heavy"])
     ax.text(0, 0.94, "Snow uses solid lines with shading underneath. Rain denoted by dotted lines.", transform=ax.transAxes)
-    for loc in LOCATIONS:
-        x = rain_data[loc][1]
-        y = rain_data[loc][0]
-        y_snow = snow_data[loc][0]
+    for loc in locations:
+        x = data[loc]["dates"]
+        y = [r[2] for r in data[loc]["rain"]]
+        y_snow = [s[2] for s in data[loc]["snow"]]
         l = ax.plot(x, y, linestyle="--")
         ax.plot(x, y_snow, color=l[0].get_color(), label=loc)
-        ax.fill_between(x, y_snow, alpha=0.2, color=l[0].get_color())
-        ax.set_ylabel("How rainy/snowy")
-        ax.set_xticklabels(x, rotation=45)
+
+        if weekly:
+            ax.fill_between(x, [s[0] for s in data[loc]["snow"]], [s[1] for s in data[loc]["snow"]], alpha=0.2, color=l[0].get_color())
+        else:
+            ax.fill_between(x, y_snow, alpha=0.2, color=l[0].get_color())
+    ax.set_ylabel("How rainy/snowy")
     ax.legend()
 
-    fig.tight_layout()
 
-    img = BytesIO()
-    plt.savefig(img)
-    img.seek(0)
-    return img
+# Panels of the main image from top to bottom, each also served on its own as /charts/<name>.png
+PANELS = {"freezing_level": plot_freezing_level,
+          "wind": plot_wind,
+          "cloud": plot_cloud,
+          "precipitation": plot_precipitation}
 
+# Series drawn by each panel, so that a panel only waits for its own series to be prepared
+PANEL_SERIES = {"freezing_level": ["freezing_level"],
+                "wind": ["wind_speed", "wind_direction"],
+                "cloud": ["cloud_free"],
+                "precipitation": ["rain", "snow"]}
 
-def freezing_level_data_preparation():
-    plot_data = {}
-    for loc in LOCATIONS:
-        f = get_raw_forecasts(data, loc, "freezing_level")
-        f_numeric = [freezing_level_to_numeric(x[1]) for x in f]
-        dates = [x[0] for x in f]
-        plot_data[loc] = (f_numeric, dates)
-    return plot_data
 
+def plot_ranges(ax, data: Dict, locations: List[str], series: str, weekly: bool) -> None:
+    """Shade the (low, high) range of series for each location, with a line through the middle value"""
+    for loc in locations:
+        x = data[loc]["dates"]
+        y_min = [v[0] for v in data[loc][series]]
+        y_max = [v[1] for v in data[loc][series]]
+        y_mid = [v[2] for v in data[loc][series]]
+        ax.fill_between(x, y_min, y_max, alpha=0.2)
 
-def wind_data_preparation():
-    plot_data = {}
-    for loc in LOCATIONS:
-        f = get_raw_forecasts(data, loc, "how_windy")
-        f_numeric = [wind_to_numeric(x[1]) for x in f]
-        dates = [x[0] for x in f]
-        plot_data[loc] = (f_numeric, dates)
-    return plot_data
+        if weekly:
+            ax.plot(x, y_mid, marker="o", markersize=3, label=loc)
+        else:
+            y_err = [hi - mid for hi, mid in zip(y_max, y_mid)]
+            ax.errorbar(x, y_mid, yerr=y_err, capsize=5, marker="o", label=loc)
 
 
-def wind_direction_preparation():
-    plot_data = {}
-    for loc in LOCATIONS:
-        f = get_raw_forecasts(data, loc, "how_windy")
-        f_cat = [get_wind_direction(x[1]) for x in f]
-        dates = [x[0] for x in f]
-        plot_data[loc] = (f_cat, dates)
-    return plot_data
+PREPARED_VERSIONS = 4  # Snapshot versions kept for each series, e.g. the current one and a season read from the archive
 
+_prepared = OrderedDict()  # (snapshot version, series name) -> {location: (values, dates)}, least recently used first
+_prepared_lock = threading.Lock()  # Guards _prepared, only held briefly
 
-def cloud_data_preparation():
-    plot_data = {}
-    for loc in LOCATIONS:
-        f = get_raw_forecasts(data, loc, "chance_cloud_free")
-        f_numeric = [cloud_to_numeric(x[1]) for x in f]
-        dates = [x[0] for x in f]
-        plot_data[loc] = (f_numeric, dates)
-    return plot_data
 
+def prepared_series(snapshot: ForecastSnapshot, names: List[str] = None) -> Dict:
+    """The named series, or all of them, for every location and date, as {location: {"dates": [...], series: [...]}}.
+    Each series is prepared once per snapshot version, and on its own, so that e.g. the freezing level panel
+    does not wait for the rain and snow series to run every forecast through spaCy.
+    """
+    if names is None:
+        names = list(SERIES_PREPARATION)
 
-def rain_data_preparation():
-    plot_data = {}
-    for loc in LOCATIONS:
-        f = get_raw_forecasts(data, loc, "how_wet")
-        f_numeric = [how_wet_to_numeric(x[1]) for x in f]
-        dates = [x[0] for x in f]
-        plot_data[loc] = (f_numeric, dates)
-    return plot_data
+    data = {loc: {} for loc in snapshot.locations}
+    for name in names:
+        for loc, (values, dates) in _prepared_one_series(snapshot, name).items():
+            data[loc]["dates"] = dates
+            data[loc][name] = values
+
+    return data
+
+
+def _prepared_one_series(snapshot: ForecastSnapshot, name: str) -> Dict:
+    key = (snapshot.version, name)
+
+    # Held while preparing, so that concurrent requests after an update wait for one preparation of the series
+    with _series_locks[name]:
+        with _prepared_lock:
+            if key in _prepared:
+                _prepared.move_to_end(key)
+                return _prepared[key]
+
+        # Rain and snow are scored with spaCy, the other series with regular expressions
+        with stage("nlp" if name in ("rain", "snow") else "prepare"):
+            series = SERIES_PREPARATION[name](snapshot)
+
+        with _prepared_lock:
+            _prepared[key] = series
+            while len(_prepared) > PREPARED_VERSIONS * len(SERIES_PREPARATION):
+                _prepared.popitem(last=False)
+
+        return series
+
+
+def window_series(data: Dict, start: Optional[str], end: Optional[str]) -> Dict:
+    """Series for dates from start to end inclusive, ISO dates with either left open"""
+    result = {}
+    for loc, series in data.items():
+        dates = series["dates"]
+
+        # Dates are ISO strings in order, so the range is found by bisection
+        lo = 0 if start is None else bisect.bisect_left(dates, start)
+        hi = len(dates) if end is None else bisect.bisect_right(dates, end)
+
+        result[loc] = {k: v[lo:hi] for k, v in series.items()}
+
+    return result
+
+
+def summarise_series(series: Dict, weekly: bool) -> Dict:
+    """Series with datetime.date x values and (low, high, middle) y values. Daily values keep their range
+    and its midpoint, weekly ones have the lowest and highest value in the week and the median day.
+    Wind directions become the set seen during the day or week.
+    """
+    dates = [datetime.date.fromisoformat(d) for d in series["dates"]]
+    if weekly:
+        dates = [d - datetime.timedelta(days=d.weekday()) for d in dates]
+
+    groups = {}
+    for i, d in enumerate(dates):
+        groups.setdefault(d, []).append(i)
+
+    result = {"dates": list(groups)}
+    for name, values in series.items():
+        if name == "dates":
+            continue
+
+        result[name] = []
+        for indices in groups.values():
+            group = [values[i] for i in indices]
+
+            if name == "wind_direction":
+                result[name].append(set().union(*group))
+            elif isinstance(group[0], tuple):
+                result[name].append((min(v[0] for v in group), max(v[1] for v in group),
+                                     statistics.median(0.5 * (v[0] + v[1]) for v in group)))
+            else:
+                result[name].append((min(group), max(group), statistics.median(group)))
 
-def snow_data_preparation():
+    return result
+
+
+def chart_window(days: Optional[int] = None, season: Optional[int] = None, start: Optional[str] = None,
+                 end: Optional[str] = None, today: datetime.date = None) -> Tuple[Optional[str], Optional[str]]:
+    """(start, end) ISO dates for the last N days (plus the days forecast ahead), the season starting in
+    the given year, or an explicit range. With none of them, the current season.
+    """
+    if today is None:
+        today = datetime.date.today()
+
+    if days is not None:
+        return str(today - datetime.timedelta(days=days)), None
+
+    if season is not None:
+        first_day = season_start(datetime.date(season, 12, 1))
+        return str(first_day), str(season_start(first_day + datetime.timedelta(days=366)) - datetime.timedelta(days=1))
+
+    if start is None and end is None:
+        return str(season_start(today)), None
+
+    return start, end
+
+
+def series_from_features(snapshot: ForecastSnapshot, forecast_attr: str, from_features: Callable, from_text: Callable) -> Dict:
+    """{location: (values, dates)} for the latest forecast of each date. Values are read from the forecast's
+    mwis_features row by from_features where it has one, so e.g. rain and snow need not be scored with
+    spaCy. Forecasts without features yet, or where from_features gives None, are converted from their
+    forecast_attr text by from_text.
+    """
     plot_data = {}
-    for loc in LOCATIONS:
-        f = get_raw_forecasts(data, loc, "how_wet")
-        f_numeric = [how_snowy_to_numeric(x[1]) for x in f]
-        dates = [x[0] for x in f]
-        plot_data[loc] = (f_numeric, dates)
+    for loc in snapshot.locations:
+        values = []
+        dates = []
+        for row in snapshot.latest.get(loc, ()):
+            features = snapshot.features.get(row["id"])
+            value = from_features(features) if features is not None else None
+            values.append(from_text(row[forecast_attr]) if value is None else value)
+            dates.append(row["date"])
+        plot_data[loc] = (values, dates)
     return plot_data
 
 
+def freezing_level_data_preparation(snapshot: ForecastSnapshot):
+    return series_from_features(snapshot, "freezing_level", lambda f: (f["freezing_level_min"], f["freezing_level_max"]),
+                                freezing_level_to_numeric)
+
+
+def wind_data_preparation(snapshot: ForecastSnapshot):
+    return series_from_features(snapshot, "how_windy", lambda f: (f["wind_min"], f["wind_max"]), wind_to_numeric)
+
+
+def wind_direction_preparation(snapshot: ForecastSnapshot):
+    return series_from_features(snapshot, "how_windy", lambda f: wind_directions_from_str(f["wind_directions"]),
+                                get_wind_direction)
+
+
+def cloud_data_preparation(snapshot: ForecastSnapshot):
+    return series_from_features(snapshot, "chance_cloud_free", lambda f: (f["cloud_free_min"], f["cloud_free_max"]),
+                                cloud_to_numeric)
+
+
+# A NULL score means no precipitation terms were found, which how_wet_to_numeric reports as an error
+def rain_data_preparation(snapshot: ForecastSnapshot):
+    return series_from_features(snapshot, "how_wet", lambda f: f["rain_score"], how_wet_to_numeric)
+
+
+def snow_data_preparation(snapshot: ForecastSnapshot):
+    return series_from_features(snapshot, "how_wet", lambda f: f["snow_score"], how_snowy_to_numeric)
+
 
+# Series names used by prepared_series and the chart data API, with their preparation functions
+SERIES_PREPARATION = {"freezing_level": freezing_level_data_preparation,
+                      "wind_speed": wind_data_preparation,
+                      "wind_direction": wind_direction_preparation,
+                      "cloud_free": cloud_data_preparation,
+                      "rain": rain_data_preparation,
+                      "snow": snow_data_preparation}
 
-get_main_image()
+# Held while a series is prepared, see prepared_series
+_series_locks = {name: threading.Lock() for name in SERIES_PREPARATION}
@@ -0,0 +1,64 @@
+"""Production server mode for the web app, run from the repository root with
+
+    gunicorn -c src/web_app/gunicorn_conf.py src.web_app.wsgi:app
+
+The app is imported once in the master process (preload_app), which loads the spaCy model, and warmed up
+before any workers are forked, so the workers share the model and caches rather than each loading a copy.
+
+Each scrape of /metrics is answered by one worker, which adds up the metrics that every worker has written
+to MWIS_METRICS_DIR, see share_between_processes in src/web_app/metrics.py.
+"""
+import gc
+import os
+from pathlib import Path
+
+from src.utils import mwis_metrics_dir, setup_logging
+from src.web_app import metrics
+
+
+bind = os.environ.get("MWIS_BIND", "127.0.0.1:8000")
+workers = int(os.environ.get("MWIS_WORKERS", 2))
+
+# Threads per worker for requests, renders still go through each worker's bounded render pool
+worker_class = "gthread"
+threads = int(os.environ.get("MWIS_THREADS", 4))
+
+preload_app = True
+timeout = 120
+
+metrics_dir = Path(os.environ.get("MWIS_METRICS_DIR", mwis_metrics_dir()))
+
+# Workers inherit this from the master, for the app's own log lines
+setup_logging()
+
+
+# Objects allocated while preloading are not collected in the master, see when_ready
+gc.disable()
+
+
+def on_starting(server):
+    # Counters start from zero with the server, as Prometheus expects after a restart
+    for path in metrics_dir.glob("*.json"):
+        path.unlink()
+
+
+def when_ready(server):
+    from src.web_app.wsgi import warm_up
+    warm_up()
+
+    # The warm-up's stage timings, written once by the master
+    metrics.share_between_processes(metrics_dir, interval=None)
+    metrics.write_process_metrics()
+
+    # Move every object so far into the permanent generation, which the collector never visits. Otherwise
+    # a collection in a worker writes to the reference counts and gc headers of the preloaded objects,
+    # copying the pages they sit on into that worker.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    gc.enable()
+
+    # Only what this worker does from now on, the master's values are in its own file
+    metrics.reset_metrics()
+    metrics.share_between_processes(metrics_dir)
@@ -0,0 +1,259 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from src.utils import write_atomically
+
+
+logger = logging.getLogger(__name__)
+
+
+# Upper bounds in seconds, from a cached response to a cold render with spaCy parsing
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        global _changed
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+        _changed = True
+
+    def values(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values = {}
+
+    @staticmethod
+    def merge(all_values: Iterable[Dict]) -> Dict[Tuple[str, ...], float]:
+        merged = {}
+        for values in all_values:
+            for label_values, value in values.items():
+                merged[label_values] = merged.get(label_values, 0) + value
+
+        return merged
+
+    def samples(self, values: Dict = None) -> List[str]:
+        if values is None:
+            values = self.values()
+
+        return [f"{self.name}{format_labels(self.label_names, k)} {v}" for k, v in sorted(values.items())]
+
+    def exposition(self, values: Dict = None) -> str:
+        return "\n".join([f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"] + self.samples(values))
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._values = {}  # label values -> [count per bucket, sum, count]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *label_values: str) -> None:
+        global _changed
+        with self._lock:
+            bucket_counts, total, count = self._values.get(label_values, ([0] * len(self.buckets), 0.0, 0))
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    bucket_counts[i] += 1
+
+            self._values[label_values] = (bucket_counts, total + value, count + 1)
+        _changed = True
+
+    def values(self) -> Dict[Tuple[str, ...], Tuple[List[int], float, int]]:
+        with self._lock:
+            return {k: (list(b), s, c) for k, (b, s, c) in self._values.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values = {}
+
+    @staticmethod
+    def merge(all_values: Iterable[Dict]) -> Dict[Tuple[str, ...], Tuple[List[int], float, int]]:
+        merged = {}
+        for values in all_values:
+            for label_values, (bucket_counts, total, count) in values.items():
+                if label_values in merged:
+                    merged_counts, merged_total, merged_count = merged[label_values]
+                    bucket_counts = [a + b for a, b in zip(merged_counts, bucket_counts)]
+                    total += merged_total
+                    count += merged_count
+                merged[label_values] = (list(bucket_counts), total, count)
+
+        return merged
+
+    def exposition(self, values: Dict = None) -> str:
+        if values is None:
+            values = self.values()
+
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (bucket_counts, total, count) in sorted(values.items()):
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                labels = format_labels(self.label_names + ("le",), label_values + (str(bound),))
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+
+            labels = format_labels(self.label_names + ("le",), label_values + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, label_values)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, label_values)} {count}")
+
+        return "\n".join(lines)
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+REGISTRY = []
+
+
+def exposition() -> str:
+    """All metrics in the Prometheus text format, added up over every process sharing them if
+    share_between_processes has been called, otherwise those of this process"""
+    if _shared_dir is None:
+        return "\n".join(metric.exposition() for metric in REGISTRY) + "\n"
+
+    write_process_metrics()
+    processes = read_shared_metrics()
+
+    return "\n".join(metric.exposition(metric.merge(p.get(metric.name, {}) for p in processes))
+                     for metric in REGISTRY) + "\n"
+
+
+# Multi-process mode, e.g. under gunicorn, where each scrape of /metrics reaches just one worker. Every
+# process writes its own values to <pid>.json in a shared directory, and exposition() adds up all the files.
+# Files of processes which have exited are kept, so that the counters never go down when a worker is
+# replaced. The directory should be emptied when the server starts.
+SHARE_INTERVAL = 1.0  # Seconds between writes of a process's values, if any have changed
+
+_shared_dir: Optional[Path] = None
+_changed = False  # Set on every update, cleared when the values are written
+
+
+def share_between_processes(directory: Path, interval: Optional[float] = SHARE_INTERVAL) -> None:
+    """Write this process's metrics to directory, every interval seconds from a background thread
+    unless interval is None, and when the process exits. Call in each process after it forks.
+    """
+    global _shared_dir
+    directory.mkdir(parents=True, exist_ok=True)
+    _shared_dir = directory
+
+    if interval is not None:
+        threading.Thread(target=_write_periodically, args=(interval,), name="metrics", daemon=True).start()
+
+    atexit.register(write_process_metrics)
+
+
+def _write_periodically(interval: float) -> None:
+    while True:
+        time.sleep(interval)
+        if _changed:
+            write_process_metrics()
+
+
+def write_process_metrics() -> None:
+    global _changed
+    if _shared_dir is None:
+        return
+
+    _changed = False
+    values = {metric.name: [[list(k), v] for k, v in metric.values().items()] for metric in REGISTRY}
+
+    try:
+        write_atomically(_shared_dir / f"{os.getpid()}.json", json.dumps(values).encode())
+    except OSError as e:
+        logger.warning(f"Could not write metrics to {_shared_dir}: {e}")
+
+
+def read_shared_metrics() -> List[Dict[str, Dict]]:
+    """The values written by each process, as {metric name: {label values: value}}"""
+    processes = []
+    for path in _shared_dir.glob("*.json"):
+        try:
+            values = json.loads(path.read_text())
+        except (OSError, ValueError):
+            # Deleted by a restart of the server since the directory was listed
+            continue
+
+        processes.append({name: {tuple(k): v for k, v in samples} for name, samples in values.items()})
+
+    return processes
+
+
+def reset_metrics() -> None:
+    """Start every metric from zero, e.g. in a worker process, which would otherwise also count what the
+    master process did before it forked"""
+    for metric in REGISTRY:
+        metric.reset()
+
+
+REQUESTS = Counter("mwis_http_requests_total", "Requests handled, by endpoint and status code", ("endpoint", "status"))
+REQUEST_SECONDS = Histogram("mwis_http_request_duration_seconds", "Time to handle a request, by endpoint", ("endpoint",))
+STAGE_SECONDS = Histogram("mwis_stage_duration_seconds", "Time spent in each stage of producing a response", ("stage",))
+RENDER_SECONDS = Histogram("mwis_render_duration_seconds", "Time to render an image which was not cached, by kind", ("kind",))
+CACHE_LOOKUPS = Counter("mwis_render_cache_lookups_total", "Rendered image lookups: hit, miss (rendered), wait (joined a render in progress) or prerendered", ("result",))
+RENDER_REJECTIONS = Counter("mwis_render_rejections_total", "Renders refused as the queue was full or timed out", ("reason",))
+
+
+class StageTimes:
+    """Time per stage for one request, filled in by whichever threads work on it. Stages which ran in
+    parallel, e.g. the panels of the main image, are added together, so can sum to more than the request took.
+    """
+    def __init__(self):
+        self._times = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._times[stage] = self._times.get(stage, 0.0) + seconds
+
+    def as_ms(self) -> Dict[str, float]:
+        with self._lock:
+            return {stage: round(1000 * seconds, 2) for stage, seconds in self._times.items()}
+
+
+# The StageTimes of the request being handled. Work handed to other threads should run in a copy of the
+# context (contextvars.copy_context()), so that its stages are added to the same request.
+current_stage_times: contextvars.ContextVar[Optional[StageTimes]] = contextvars.ContextVar("current_stage_times", default=None)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time the block into the stage histogram, and the current request's breakdown if there is one"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, name)
+
+        stage_times = current_stage_times.get()
+        if stage_times is not None:
+            stage_times.add(name, seconds)
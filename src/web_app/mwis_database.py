@@ -1,38 +1,244 @@
-from sqlalchemy import MetaData, create_engine, Column, String, Integer
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+import datetime
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
+from src.database_connection import QueryError, connect
+from src.mwis_features import PARSER_VERSION
+from src.mwis_queries import run_query, run_scalar_query
 from src.utils import database_cache_path
+from src.web_app.metrics import stage
+
+
+logger = logging.getLogger(__name__)
 
 
 db_path = database_cache_path()
-metadata = MetaData()
-engine = create_engine(f'sqlite:///{db_path}', connect_args={'check_same_thread': False}, echo=False)  # echo=False
-Base = declarative_base()
-db_session = sessionmaker(bind=engine)()
 
+ARCHIVE_WINDOWS = 4  # Snapshots of chart windows reaching into the archive table kept in memory, e.g. past seasons
+
+# Open ends of a window in forecasts_in_date_range, ISO dates compare as strings
+FIRST_DATE, LAST_DATE = "0001-01-01", "9999-12-31"
+
+
+class ForecastSnapshot(NamedTuple):
+    """Immutable view of the mwis table at one point in time. Requests hold on to the snapshot they
+    started with, so a refresh never changes data underneath them. ForecastCache.window_snapshot gives
+    snapshots of the full history in one chart window, which also cover the archive table.
+    """
+    by_location: Dict[str, Tuple]  # Rows for each location, in id order
+    latest: Dict[str, Tuple]  # For each location, the latest forecast (lowest days_ahead) for every date, in date order
+    max_id: int
+    num_rows: int
+    last_issued: Optional[str]  # Latest date a forecast was issued (date - days_ahead), None if there are none
+    features: Dict[int, Tuple] = {}  # mwis_features row of each forecast which has current ones, by mwis id
+    archived_until: Optional[str] = None  # Latest date of the archived forecasts older than the mwis table
+    window: Optional[str] = None  # For a snapshot of one chart window, the hot version and the window
+
+    @property
+    def locations(self) -> List[str]:
+        return sorted(self.by_location)
+
+    @property
+    def version(self) -> str:
+        """Changes whenever rows are added to or removed from the mwis table, as ids are never reused. Features
+        computed later do not change it, as they hold the same values the charts would otherwise compute.
+        """
+        version = f"{self.max_id}.{self.num_rows}"
+        return version if self.window is None else f"{version}/{self.window}"
+
+    def latest_forecasts(self, location: str, forecast_attr: str) -> List[Tuple]:
+        """(date, value) of forecast_attr from the latest forecast for each date, the same as get_raw_forecasts
+        """
+        return [(row["date"], row[forecast_attr]) for row in self.latest.get(location, ())]
+
+    def issue_date(self) -> Optional[datetime.date]:
+        """The day of the latest forecast, which chart windows such as the last 7 days count back from, so that
+        they only move on when the data does
+        """
+        return datetime.date.fromisoformat(self.last_issued) if self.last_issued is not None else None
+
+
+EMPTY_SNAPSHOT = ForecastSnapshot(by_location={}, latest={}, max_id=0, num_rows=0, last_issued=None)
+
+
+class ForecastCache:
+    """In-memory copy of the mwis table which picks up rows added by the scraper without a restart.
+
+    Each call to snapshot() checks PRAGMA data_version, which only changes when another connection
+    commits to the database, so the check costs microseconds when nothing has happened. When it has
+    changed, only rows past the largest id seen so far are fetched, and only the locations they belong to
+    are rebuilt. Rows removed by maintenance show up as a count mismatch, which triggers a full reload.
+    The features of the rows are read again in full, as they are filled in after the rows are added.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._snapshot = EMPTY_SNAPSHOT
+        self._data_version = None
+        self._conn = None
+        self._refresh_lock = threading.Lock()  # Also held while window snapshots are read, which use the same connection
+        self._windows = OrderedDict()  # (version, start, end) -> ForecastSnapshot, least recently used first
+
+    def snapshot(self) -> ForecastSnapshot:
+        # Only one thread refreshes at a time, the others carry on with the current snapshot unless there is none yet
+        blocking = self._data_version is None
+        if self._refresh_lock.acquire(blocking=blocking):
+            try:
+                self._refresh_if_changed()
+            finally:
+                self._refresh_lock.release()
+
+        return self._snapshot
+
+    def window_snapshot(self, snapshot: ForecastSnapshot, start: Optional[str], end: Optional[str]) -> ForecastSnapshot:
+        """snapshot itself if the mwis table holds every forecast dated from start to end (ISO dates, either can
+        be left open), e.g. for windows in the current season. Otherwise a snapshot of the forecasts in the
+        window read from mwis_all, so that past seasons are still charted after they have been archived. These
+        are kept for the ARCHIVE_WINDOWS most recently used windows, until the data changes.
+        """
+        if start is not None and (snapshot.archived_until is None or start > snapshot.archived_until):
+            return snapshot
+
+        key = (snapshot.version, start, end)
+        with self._refresh_lock:
+            if key in self._windows:
+                self._windows.move_to_end(key)
+                return self._windows[key]
+
+            params = {"start": start or FIRST_DATE, "end": end or LAST_DATE, "parser_version": PARSER_VERSION}
+
+            with stage("load_forecasts"):
+                conn = self._connection()
+                conn.execute("BEGIN")
+                try:
+                    rows = run_query(conn, "forecasts_in_date_range", params)
+                    features = run_query(conn, "forecast_features_in_date_range", params)
+                finally:
+                    conn.execute("COMMIT")
+
+            # Every location of the current data, so that a window without forecasts for one charts it as empty
+            empty = EMPTY_SNAPSHOT._replace(by_location={loc: () for loc in snapshot.locations},
+                                            latest={loc: () for loc in snapshot.locations},
+                                            features={row["mwis_id"]: row for row in features},
+                                            window=f"{snapshot.version}:{start}:{end}")
+            window = apply_new_rows(empty, sorted(rows, key=lambda row: row["id"]))
+
+            self._windows[key] = window
+            while len(self._windows) > ARCHIVE_WINDOWS:
+                self._windows.popitem(last=False)
+
+        logger.info(f"Read {window.num_rows} forecasts from {start} to {end} including the archive table")
+        return window
 
-class Mwis(Base):
-    __tablename__ = 'mwis'
-    id = Column(Integer, primary_key=True)
-    location = Column(String)
-    date = Column(String)
-    days_ahead = Column(String)
-    headline = Column(String)
-    freezing_level = Column(String)
-    how_windy = Column(String)
-    chance_cloud_free = Column(String)
-    how_wet = Column(String)
+    def close(self) -> None:
+        """Close the database connection, e.g. before the process forks, keeping the current snapshot. The
+        next call to snapshot() reconnects and checks for changes made since.
+        """
+        with self._refresh_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
 
+            # data_version is per connection, so the value from the old one means nothing to the new one
+            self._data_version = None
 
-# Retrieving data from the database
-def get_mwis_forecast():
-    return db_session.query(Mwis)
+    def _connection(self):
+        # Used only while holding the refresh lock
+        if self._conn is None:
+            self._conn = connect(self.db_path, check_same_thread=False)
 
+        return self._conn
 
+    def _refresh_if_changed(self) -> None:
+        data_version = self._connection().execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
 
+        current = self._snapshot
+
+        with stage("load_forecasts"):
+            # One read transaction, so the new rows and the count come from the same version of the table
+            self._conn.execute("BEGIN")
+            try:
+                new_rows = run_query(self._conn, "forecasts_after_id", {"after_id": current.max_id})
+                num_rows = run_scalar_query(self._conn, "count_hot_forecasts")
+
+                if current.num_rows + len(new_rows) != num_rows:
+                    logger.info("Rows were removed from the mwis table, reloading forecast cache")
+                    current = EMPTY_SNAPSHOT
+                    new_rows = run_query(self._conn, "all_forecasts")
+
+                features = self._load_features()
+                archived_until = run_scalar_query(self._conn, "latest_archived_date_before_hot")
+            finally:
+                self._conn.execute("COMMIT")
+
+            self._snapshot = apply_new_rows(current, new_rows)._replace(features=features, archived_until=archived_until)
+        self._data_version = data_version
+
+        logger.info(f"Forecast cache now holds {self._snapshot.num_rows} rows ({len(new_rows)} new), "
+                    f"{len(features)} with features")
+
+    def _load_features(self) -> Dict[int, Tuple]:
+        # Used only while holding the refresh lock. Charts compute the values themselves for rows without features.
+        try:
+            rows = run_query(self._conn, "hot_forecast_features", {"parser_version": PARSER_VERSION})
+        except QueryError as e:
+            logger.warning(f"Forecast features not loaded: {e}")
+            return {}
+
+        return {row["mwis_id"]: row for row in rows}
+
+
+def apply_new_rows(snapshot: ForecastSnapshot, new_rows: List) -> ForecastSnapshot:
+    """New snapshot with the rows added, sharing the unchanged locations with the old one
+    """
+    if not new_rows:
+        return snapshot
+
+    added = {}
+    for row in new_rows:
+        added.setdefault(row["location"], []).append(row)
+
+    by_location = dict(snapshot.by_location)
+    latest = dict(snapshot.latest)
+    for location, rows in added.items():
+        by_location[location] = by_location.get(location, ()) + tuple(rows)
+        latest[location] = merge_latest(latest.get(location, ()), rows)
+
+    issued = max(datetime.date.fromisoformat(row["date"]) - datetime.timedelta(days=int(row["days_ahead"]))
+                 for row in new_rows)
+    if snapshot.last_issued is not None:
+        issued = max(issued, snapshot.issue_date())
+
+    return snapshot._replace(by_location=by_location,
+                             latest=latest,
+                             max_id=new_rows[-1]["id"],
+                             num_rows=snapshot.num_rows + len(new_rows),
+                             last_issued=str(issued))
+
+
+def merge_latest(latest_rows: Tuple, new_rows: List) -> Tuple:
+    """Rows with the lowest days_ahead for each date, from the current latest rows and some new ones, in date order.
+    On a tie the row seen first is kept, as in get_latest_info_per_day.
+    """
+    by_date = {row["date"]: row for row in latest_rows}
+
+    for row in new_rows:
+        best = by_date.get(row["date"])
+        if best is None or int(row["days_ahead"]) < int(best["days_ahead"]):
+            by_date[row["date"]] = row
+
+    return tuple(by_date[date] for date in sorted(by_date))
+
+
+forecast_cache = ForecastCache(db_path)
+
+
+# Scan of all rows per call, superseded by ForecastSnapshot.latest_forecasts and kept for src/benchmark_chart_data.py
 def get_raw_forecasts(data, location, forecast_attr):
-    data_raw = [(forecast.date, forecast.days_ahead, getattr(forecast, forecast_attr)) for forecast in data if forecast.location==location]
+    data_raw = [(forecast["date"], forecast["days_ahead"], forecast[forecast_attr]) for forecast in data if forecast["location"]==location]
     return get_latest_info_per_day(data_raw)
 
 
@@ -53,7 +259,3 @@ def get_latest_info_per_day(all_forecasts):
     return sorted((k, v[1]) for k, v in forecasts.items())
 
 
-
-
-data = get_mwis_forecast()
-LOCATIONS = sorted(set(forecast.location for forecast in data))
@@ -1,13 +1,17 @@
 import re
-from typing import Tuple
+from functools import lru_cache
+from typing import Iterable, List, Tuple
 from dataclasses import dataclass
 
 import spacy
 from spacy.tokens import Token
 
+from src.utils import nlp_score_cache_path
+from src.web_app.precip_score_cache import PrecipScoreCache, Scores, rules_fingerprint
 
-Token.set_extension("modifiers", default=[])
-Token.set_extension("negated", default=False)
+
+Token.set_extension("modifiers", default=[], force=True)
+Token.set_extension("negated", default=False, force=True)
 
 
 def freezing_level_to_numeric(text) -> int:
@@ -140,7 +144,22 @@ synonyms = {"flurry": "snow",
             "sleet": "rain",
             "drizzle": "rain"}
 
-nlp = spacy.load("en_core_web_md")
+# The scoring uses lemmas, POS tags and the dependency parse, not named entities
+NLP_EXCLUDE = ["ner"]
+PIPE_BATCH_SIZE = 256  # Texts per batch in precip_scores_batch
+
+nlp = spacy.load("en_core_web_md", exclude=NLP_EXCLUDE)
+
+# Increment whenever the scoring logic below changes, so that scores saved by the previous version are not used
+SCORER_VERSION = 1
+
+score_cache = PrecipScoreCache(nlp_score_cache_path(),
+                               rules_fingerprint(scorer_version=SCORER_VERSION,
+                                                 quantity_adjs=quantity_adjs,
+                                                 synonyms=synonyms,
+                                                 precip_tokens=precip_tokens,
+                                                 possible_modifiers=possible_modifiers,
+                                                 model=f"{nlp.meta['lang']}_{nlp.meta['name']}-{nlp.meta['version']}"))
 
 def find_noun_modifiers_list(head_token, doc, multiple_precip_tokens: bool):
     """Hardcode the adjectives which we're looking for. Alternative to above.
@@ -217,13 +236,22 @@ def detect_negated_noun(token):
 
     return negated
 
-def how_wet_to_numeric(text) -> int:
+PRECIP_SCORE_CACHE_SIZE = 4096  # Distinct how_wet texts, MWIS reuses a small set of phrases
+
+
+def normalise_precip_text(text: str) -> str:
+    """The part of a how_wet text which is scored, with whitespace collapsed. Case is kept, the parse
+    depends on it.
+    """
     # Sometimes the forecast text has a main section, followed by extra comments after a semicolon
     # For simplicity just use the first statement
     if ";" in text:
         text = re.match(".*(?=;)", text)[0]
 
-    doc = nlp(text)
+    return " ".join(text.split())
+
+
+def find_precip_terms(doc) -> List[RainResult]:
     #for token in doc:
     #    print(f"{token.text}, {token.lemma_}, {token.pos_} ({spacy.explain(token.pos_)}), {token.tag_} ({spacy.explain(token.tag_)}), {token.dep_} ({spacy.explain(token.dep_)}) <- {token.head.text}")
 
@@ -232,8 +260,6 @@ def how_wet_to_numeric(text) -> int:
     if not found_precip_tokens:
         found_precip_tokens = [token for token in doc if token.lemma_.lower() in possible_modifiers]
 
-    #print(found_precip_tokens)
-
     for token in found_precip_tokens:
         token._.modifiers = find_noun_modifiers_list(token, doc, len(found_precip_tokens) > 1)
         token._.negated = detect_negated_noun(token)
@@ -244,17 +270,19 @@ def how_wet_to_numeric(text) -> int:
 
     assert len(found_precip_tokens) > 0
 
-    # Get numerical score
+    return found_precip_tokens
 
-    max_score = 0
 
-    print("\n", text)
+def precip_term_score(found_precip_tokens: List[RainResult], term: str) -> int:
+    """Numerical score for one kind of precipitation, "rain" or "snow"
+    """
+    max_score = 0
 
     for precip_token in found_precip_tokens:
         if precip_token.term == "dry" or \
-                (precip_token.term == "rain" and precip_token.negated):
+                (precip_token.term == term and precip_token.negated):
             max_score = 0
-        elif precip_token.term == "rain":
+        elif precip_token.term == term:
             if precip_token.modifiers:
                 for mod in precip_token.modifiers:
                     assert mod in quantity_adjs
@@ -262,62 +290,68 @@ def how_wet_to_numeric(text) -> int:
             else:
                 max_score = max(3, max_score)
 
-        print("\t", precip_token, "->", max_score)
-
     return max_score
-            
 
-    
 
-    
+def doc_precip_scores(doc) -> Tuple[int, int]:
+    found_precip_tokens = find_precip_terms(doc)
+    return precip_term_score(found_precip_tokens, "rain"), precip_term_score(found_precip_tokens, "snow")
 
 
-def how_snowy_to_numeric(text) -> int:
-    # Sometimes the forecast text has a main section, followed by extra comments after a semicolon
-    # For simplicity just use the first statement
-    if ";" in text:
-        text = re.match(".*(?=;)", text)[0]
+def parse_precip_scores(docs: Iterable) -> List[Scores]:
+    scores = []
+    for doc in docs:
+        try:
+            scores.append(doc_precip_scores(doc))
+        except AssertionError:
+            scores.append(None)
 
-    doc = nlp(text)
-    #for token in doc:
-    #    print(f"{token.text}, {token.lemma_}, {token.pos_} ({spacy.explain(token.pos_)}), {token.tag_} ({spacy.explain(token.tag_)}), {token.dep_} ({spacy.explain(token.dep_)}) <- {token.head.text}")
+    return scores
 
-    found_precip_tokens = [token for token in doc if token.lemma_.lower() in precip_tokens]
 
-    if not found_precip_tokens:
-        found_precip_tokens = [token for token in doc if token.lemma_.lower() in possible_modifiers]
+@lru_cache(maxsize=PRECIP_SCORE_CACHE_SIZE)
+def _normalised_precip_scores(text: str) -> Scores:
+    cached = score_cache.lookup([text])
+    if text in cached:
+        return cached[text]
 
-    #print(found_precip_tokens)
+    scores, = parse_precip_scores([nlp(text)])
+    score_cache.store({text: scores})
+    return scores
 
-    for token in found_precip_tokens:
-        token._.modifiers = find_noun_modifiers_list(token, doc, len(found_precip_tokens) > 1)
-        token._.negated = detect_negated_noun(token)
 
-    #merge_conjunction_modifiers(found_precip_tokens)
+def precip_scores(text) -> Tuple[int, int]:
+    """(rain score, snow score) of a how_wet text, from a single parse. Memoised by the normalised text,
+    and saved to score_cache so later runs need not parse it at all. Raises AssertionError if the text
+    has no precipitation terms.
+    """
+    scores = _normalised_precip_scores(normalise_precip_text(text))
+    assert scores is not None
+    return scores
 
-    found_precip_tokens = merge_precip_synonyms(found_precip_tokens)
 
-    assert len(found_precip_tokens) > 0
+def precip_scores_batch(texts: Iterable[str], batch_size: int = PIPE_BATCH_SIZE, n_process: int = 1) -> List[Scores]:
+    """(rain score, snow score) for each of texts, None for those with no precipitation terms. Each distinct
+    normalised text not already in score_cache is parsed once, streamed through nlp.pipe in batches, using
+    n_process processes.
+    """
+    normalised = [normalise_precip_text(text) for text in texts]
 
-    # Get numerical score
+    scores = score_cache.lookup(normalised)
+    new_texts = [text for text in dict.fromkeys(normalised) if text not in scores]
 
-    max_score = 0
+    if new_texts:
+        docs = nlp.pipe(new_texts, batch_size=batch_size, n_process=n_process)
+        new_scores = dict(zip(new_texts, parse_precip_scores(docs)))
+        score_cache.store(new_scores)
+        scores.update(new_scores)
 
-    print("\n", text)
+    return [scores[text] for text in normalised]
 
-    for precip_token in found_precip_tokens:
-        if precip_token.term == "dry" or \
-                (precip_token.term == "snow" and precip_token.negated):
-            max_score = 0
-        elif precip_token.term == "snow":
-            if precip_token.modifiers:
-                for mod in precip_token.modifiers:
-                    assert mod in quantity_adjs
-                    max_score = max(quantity_adjs[mod], max_score)
-            else:
-                max_score = max(3, max_score)
 
-        print("\t", precip_token, "->", max_score)
+def how_wet_to_numeric(text) -> int:
+    return precip_scores(text)[0]
 
-    return max_score
 
+def how_snowy_to_numeric(text) -> int:
+    return precip_scores(text)[1]
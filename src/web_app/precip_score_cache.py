@@ -0,0 +1,130 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+from src.database_connection import QueryError, connect
+from src.database_functions import execute_many_query, execute_query
+
+
+logger = logging.getLogger(__name__)
+
+
+# (rain score, snow score) of a text, None if it has no precipitation terms
+Scores = Optional[Tuple[int, int]]
+
+CREATE_TABLE = """CREATE TABLE IF NOT EXISTS precip_scores (
+                      text_hash TEXT NOT NULL,
+                      fingerprint TEXT NOT NULL,
+                      rain_score INTEGER,
+                      snow_score INTEGER,
+                      PRIMARY KEY (text_hash, fingerprint)
+                  ) WITHOUT ROWID"""
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def rules_fingerprint(**parts) -> str:
+    """Hash of everything the scores depend on, e.g. the rule tables and the spaCy model version. Sets are
+    hashed in sorted order, so the fingerprint only changes when the contents do.
+    """
+    encoded = json.dumps(parts, sort_keys=True, default=sorted)
+    return hashlib.sha256(encoded.encode()).hexdigest()[:16]
+
+
+class PrecipScoreCache:
+    """Scores of normalised how_wet texts kept in an SQLite file, so that a restart does not parse text
+    which has been scored before.
+
+    Rows are keyed by a hash of the text and the fingerprint of the rules and model which scored it. After
+    a rule table changes, the texts are scored again and the rows scored under the old rules are deleted.
+    All rows for the current fingerprint are read into memory on first use, and new scores are written
+    through one connection per process.
+    """
+    def __init__(self, db_path: Path, fingerprint: str):
+        self.db_path = db_path
+        self.fingerprint = fingerprint
+        self._scores = None  # text hash -> Scores
+        self._conn = None
+        self._conn_pid = None
+        self._unavailable = False  # The file could not be read, scores are then only kept in memory
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Used only while holding the lock. A connection inherited from before a fork is dropped rather than
+        # closed, as the parent process may still be using it.
+        if self._conn is None or self._conn_pid != os.getpid():
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = connect(self.db_path, check_same_thread=False)
+            self._conn_pid = os.getpid()
+
+        return self._conn
+
+    def _load(self) -> Dict[str, Scores]:
+        # Used only while holding the lock
+        if self._scores is None:
+            self._scores = {}
+
+            try:
+                conn = self._connection()
+                with conn:
+                    cursor = conn.cursor()
+                    execute_query(CREATE_TABLE, cursor)
+
+                    # Rows from older rules or models would never be looked up again
+                    execute_query("DELETE FROM precip_scores WHERE fingerprint != ?", cursor, (self.fingerprint,))
+                    if cursor.rowcount > 0:
+                        logger.info(f"Deleted {cursor.rowcount} precipitation scores from previous rules")
+
+                    execute_query("SELECT text_hash, rain_score, snow_score FROM precip_scores WHERE fingerprint = ?",
+                                  cursor, (self.fingerprint,))
+
+                    for key, rain_score, snow_score in cursor.fetchall():
+                        self._scores[key] = None if rain_score is None else (rain_score, snow_score)
+            except (OSError, sqlite3.Error, QueryError) as e:
+                # Scoring still works without the file, it just starts from nothing
+                logger.warning(f"Could not read precipitation scores from {self.db_path}, not saving any: {e}")
+                self._unavailable = True
+
+            logger.info(f"Loaded {len(self._scores)} precipitation scores for rules {self.fingerprint}")
+
+        return self._scores
+
+    def lookup(self, texts: Iterable[str]) -> Dict[str, Scores]:
+        """Cached scores of those of texts which have been scored under the current rules"""
+        with self._lock:
+            scores = self._load()
+            keys = {text: text_hash(text) for text in texts}
+            return {text: scores[key] for text, key in keys.items() if key in scores}
+
+    def store(self, new_scores: Dict[str, Scores]) -> None:
+        if not new_scores:
+            return
+
+        rows = {text_hash(text): scores for text, scores in new_scores.items()}
+
+        with self._lock:
+            self._load().update(rows)
+            if self._unavailable:
+                return
+
+            try:
+                conn = self._connection()
+                with conn:
+                    execute_many_query("INSERT OR REPLACE INTO precip_scores VALUES (?, ?, ?, ?)", conn.cursor(),
+                                       [(key, self.fingerprint, *(scores or (None, None))) for key, scores in rows.items()])
+            except (sqlite3.Error, QueryError) as e:
+                logger.warning(f"Could not save {len(rows)} precipitation scores to {self.db_path}: {e}")
+
+    def close(self) -> None:
+        """Close the database connection, e.g. before the process forks, keeping the scores in memory"""
+        with self._lock:
+            if self._conn is not None and self._conn_pid == os.getpid():
+                self._conn.close()
+            self._conn = None
@@ -0,0 +1,136 @@
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from src.utils import mwis_chart_dir, setup_logging, write_atomically
+from src.web_app.charts import RENDER_VERSION, chart_window, get_main_image
+from src.web_app.mwis_database import ForecastSnapshot, forecast_cache
+from src.web_app.render_cache import CachedImage, make_cached_image
+
+
+logger = logging.getLogger(__name__)
+
+
+MANIFEST_NAME = "manifest.json"
+
+# Windows rendered for all regions together, keyword arguments to chart_window. The default view is
+# also rendered for each region on its own.
+STANDARD_WINDOWS = {"default": {}, "last-7-days": {"days": 7}, "last-30-days": {"days": 30}}
+
+
+def chart_key(start: Optional[str], end: Optional[str], locations: Optional[List[str]]) -> str:
+    """Manifest key for a chart request, the same for the pre-render and the web app. Charts pre-rendered
+    by code with another RENDER_VERSION are not served, and are rendered again by the next pre-render."""
+    return f"{RENDER_VERSION}|{start}|{end}|{','.join(locations) if locations else 'all'}"
+
+
+def standard_charts(snapshot: ForecastSnapshot) -> Dict[str, Tuple]:
+    """(start, end, locations) of each standard chart, by name. The windows count back from the snapshot's
+    issue date, as the web app's do, so the keys only change along with the data."""
+    today = snapshot.issue_date()
+    charts = {name: (*chart_window(**window, today=today), None) for name, window in STANDARD_WINDOWS.items()}
+
+    start, end = chart_window(today=today)
+    for loc in snapshot.locations:
+        charts[f"default-{loc}"] = (start, end, [loc])
+
+    return charts
+
+
+def load_manifest(chart_dir: Path = None) -> Dict:
+    if chart_dir is None:
+        chart_dir = mwis_chart_dir()
+
+    try:
+        with open(chart_dir / MANIFEST_NAME) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"version": None, "charts": {}}
+
+
+def prerender_charts(chart_dir: Path = None) -> None:
+    """Render the standard charts for the current data into chart_dir, along with a manifest which the web
+    app serves them from. Run after each scrape which adds forecasts, and does nothing if the charts are
+    already up to date.
+
+    Images are named by content hash, so the old manifest stays valid until the new one replaces it, and
+    files no longer listed are deleted after that.
+    """
+    if chart_dir is None:
+        chart_dir = mwis_chart_dir()
+    chart_dir.mkdir(parents=True, exist_ok=True)
+
+    snapshot = forecast_cache.snapshot()
+    charts = {chart_key(*window): (name, window) for name, window in standard_charts(snapshot).items()}
+
+    # The keys follow from the version, unless STANDARD_WINDOWS or RENDER_VERSION has changed since the last pre-render
+    previous = load_manifest(chart_dir)
+    if previous["version"] == snapshot.version and set(previous["charts"]) == set(charts):
+        logger.info("Pre-rendered charts are up to date")
+        return
+
+    manifest = {"version": snapshot.version, "charts": {}}
+    for key, (name, (start, end, locations)) in charts.items():
+        # As in the web app, e.g. the last 30 days early in a season reach back into the archive table
+        window = forecast_cache.window_snapshot(snapshot, start, end)
+        image = make_cached_image(get_main_image(window, start, end, locations).getvalue())
+        file_name = f"{name}-{image.etag[:16]}.png"
+
+        if not (chart_dir / file_name).exists():
+            write_atomically(chart_dir / file_name, image.data)
+
+        manifest["charts"][key] = {"name": name, "file": file_name, "etag": image.etag, "version": window.version}
+
+    write_atomically(chart_dir / MANIFEST_NAME, json.dumps(manifest, indent=1).encode())
+
+    listed = {chart["file"] for chart in manifest["charts"].values()}
+    for path in chart_dir.glob("*.png"):
+        if path.name not in listed:
+            path.unlink()
+
+    logger.info(f"Pre-rendered {len(charts)} charts for version {snapshot.version} into {chart_dir}")
+
+
+_manifest_cache = {"mtime": None, "manifest": None}
+
+
+def load_prerendered(snapshot: ForecastSnapshot, start: Optional[str], end: Optional[str],
+                     locations: Optional[List[str]], chart_dir: Path = None) -> Optional[CachedImage]:
+    """The pre-rendered chart for a request, or None if it is not a standard chart or was rendered from
+    other data. snapshot is the one the request would render from, see ForecastCache.window_snapshot. The
+    manifest is only read again when its modification time changes.
+    """
+    if chart_dir is None:
+        chart_dir = mwis_chart_dir()
+
+    try:
+        mtime = (chart_dir / MANIFEST_NAME).stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    if mtime != _manifest_cache["mtime"]:
+        _manifest_cache["manifest"] = load_manifest(chart_dir)
+        _manifest_cache["mtime"] = mtime
+
+    manifest = _manifest_cache["manifest"]
+    chart = manifest["charts"].get(chart_key(start, end, locations))
+    if chart is None or chart.get("version") != snapshot.version:
+        return None
+
+    try:
+        data = (chart_dir / chart["file"]).read_bytes()
+    except FileNotFoundError:
+        # Replaced by a newer pre-render since the manifest was read
+        return None
+
+    return CachedImage(data=data, etag=chart["etag"])
+
+
+def main():
+    setup_logging()
+    prerender_charts()
+
+
+if __name__ == "__main__":
+    main()
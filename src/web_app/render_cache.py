@@ -0,0 +1,79 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Hashable, NamedTuple
+
+from src.web_app.metrics import CACHE_LOOKUPS, RENDER_SECONDS
+
+
+logger = logging.getLogger(__name__)
+
+
+MAX_CACHED_IMAGES = 64  # Each window takes up to five, the main image and its panels
+
+
+class CachedImage(NamedTuple):
+    data: bytes
+    etag: str  # Hash of data, names the pre-rendered files by their content
+
+
+def make_cached_image(data: bytes) -> CachedImage:
+    return CachedImage(data=data, etag=hashlib.sha256(data).hexdigest())
+
+
+class RenderCache:
+    """Rendered images keyed by e.g. (chart name, snapshot version), least recently used dropped first.
+
+    Requests for a key which is being rendered wait for that render rather than starting their own,
+    so a burst of page loads after the scraper adds rows costs one render.
+    """
+    def __init__(self, max_entries: int = MAX_CACHED_IMAGES):
+        self.max_entries = max_entries
+        self._images = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, render: Callable[[], bytes]) -> CachedImage:
+        with self._lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                CACHE_LOOKUPS.inc("hit")
+                return self._images[key]
+
+            future = self._in_flight.get(key)
+            is_renderer = future is None
+            if is_renderer:
+                future = self._in_flight[key] = Future()
+
+        if not is_renderer:
+            CACHE_LOOKUPS.inc("wait")
+            return future.result()
+
+        CACHE_LOOKUPS.inc("miss")
+        start = time.perf_counter()
+
+        try:
+            image = make_cached_image(render())
+        except BaseException as e:
+            # Waiting requests get the error too, the next request for the key tries again
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._images[key] = image
+            while len(self._images) > self.max_entries:
+                self._images.popitem(last=False)
+            del self._in_flight[key]
+
+        future.set_result(image)
+
+        # Keys start with the kind of image, e.g. "main" or "panel"
+        RENDER_SECONDS.observe(time.perf_counter() - start, str(key[0]) if isinstance(key, tuple) else "other")
+        logger.info(f"Rendered {key}, {len(image.data) / 1e3:.0f} kB")
+
+        return image
@@ -0,0 +1,55 @@
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Callable
+
+from src.web_app.metrics import RENDER_REJECTIONS
+
+
+logger = logging.getLogger(__name__)
+
+
+RENDER_WORKERS = 2  # Renders running at once, each holds a full-size figure in memory
+MAX_QUEUED_RENDERS = 8  # Renders waiting for a worker, beyond which requests are turned away
+RENDER_TIMEOUT = 60  # Seconds a request waits for its render
+
+
+class RenderPoolFull(Exception):
+    """Raised when MAX_QUEUED_RENDERS renders are already waiting for a worker
+    """
+
+
+class RenderPool:
+    """Bounded pool of threads for chart rendering. Memory use is capped by the number of workers, and a
+    slow render cannot make requests pile up without limit, as they are refused once the queue is full.
+
+    Threads rather than processes, as the charts are drawn from the in-memory forecast cache and the
+    spaCy model, which would otherwise have to be loaded into every worker process.
+    """
+    def __init__(self, workers: int = RENDER_WORKERS, max_queued: int = MAX_QUEUED_RENDERS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+        self._slots = threading.BoundedSemaphore(workers + max_queued)
+
+    def render(self, render: Callable[..., bytes], *args, timeout: float = RENDER_TIMEOUT) -> bytes:
+        """Run render(*args) on a worker and return its result. Raises RenderPoolFull, or TimeoutError if
+        the render takes longer than timeout, in which case it still finishes and frees its slot.
+        """
+        if not self._slots.acquire(blocking=False):
+            RENDER_REJECTIONS.inc("queue_full")
+            raise RenderPoolFull("Too many charts waiting to be rendered")
+
+        try:
+            # In a copy of the caller's context, so that the render's stages count towards its request
+            future = self._executor.submit(contextvars.copy_context().run, render, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            RENDER_REJECTIONS.inc("timeout")
+            raise
@@ -0,0 +1,130 @@
+// Draws the forecast charts from /api/chart_data as SVG, so the page downloads a few kB of JSON
+// rather than the rendered PNG.
+
+const COLOURS = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b"];
+const SVG_NS = "http://www.w3.org/2000/svg";
+const WIDTH = 900, HEIGHT = 240, MARGIN = {left: 70, right: 20, top: 20, bottom: 60};
+const WET_LABELS = ["dry", "light", "intermittent", "constant", "heavy", "very heavy"];
+
+const PANELS = [
+    {title: "Freezing level (m)", series: "freezing_level", yMax: 1500, range: true, guide: 900},
+    {title: "Wind speed (mph)", series: "wind_speed", yMax: 100, range: true, note: "wind_direction"},
+    {title: "% cloud free", series: "cloud_free", yMax: 100, range: true},
+    {title: "How rainy/snowy (rain dashed, snow solid)", series: "snow", dashed: "rain", yMax: 5, yLabels: WET_LABELS},
+];
+
+function el(name, attrs, parent) {
+    const node = document.createElementNS(SVG_NS, name);
+    for (const [k, v] of Object.entries(attrs)) node.setAttribute(k, v);
+    if (parent) parent.appendChild(node);
+    return node;
+}
+
+function points(xs, ys) {
+    return xs.map((x, i) => `${x},${ys[i]}`).join(" ");
+}
+
+function drawPanel(panel, data, allDates) {
+    const svg = el("svg", {viewBox: `0 0 ${WIDTH} ${HEIGHT}`, width: "100%", role: "img"});
+    const plotWidth = WIDTH - MARGIN.left - MARGIN.right, plotHeight = HEIGHT - MARGIN.top - MARGIN.bottom;
+    const step = plotWidth / Math.max(allDates.length - 1, 1);
+    const dateX = new Map(allDates.map((d, i) => [d, MARGIN.left + i * step]));
+    const y = v => MARGIN.top + plotHeight * (1 - Math.min(v, panel.yMax) / panel.yMax);
+
+    el("text", {x: MARGIN.left, y: 14, "font-size": 13}, svg).textContent = panel.title;
+    el("line", {x1: MARGIN.left, x2: MARGIN.left, y1: MARGIN.top, y2: MARGIN.top + plotHeight, stroke: "black"}, svg);
+    el("line", {x1: MARGIN.left, x2: WIDTH - MARGIN.right, y1: MARGIN.top + plotHeight, y2: MARGIN.top + plotHeight, stroke: "black"}, svg);
+
+    const yTicks = panel.yLabels ? panel.yLabels.map((_, i) => i) : [0, 0.25, 0.5, 0.75, 1].map(f => f * panel.yMax);
+    for (const v of yTicks) {
+        el("text", {x: MARGIN.left - 5, y: y(v) + 4, "font-size": 10, "text-anchor": "end"}, svg)
+            .textContent = panel.yLabels ? panel.yLabels[v] : v;
+    }
+
+    // At most ~30 date labels, whatever the range
+    const labelEvery = Math.ceil(allDates.length / 30);
+    allDates.forEach((d, i) => {
+        if (i % labelEvery) return;
+        const x = dateX.get(d), yLabel = MARGIN.top + plotHeight + 10;
+        el("text", {x: x, y: yLabel, "font-size": 10, "text-anchor": "end", transform: `rotate(-45 ${x} ${yLabel})`}, svg)
+            .textContent = d;
+    });
+
+    if (panel.guide !== undefined) {
+        el("line", {x1: MARGIN.left, x2: WIDTH - MARGIN.right, y1: y(panel.guide), y2: y(panel.guide),
+                    stroke: "black", "stroke-dasharray": "4 4", opacity: 0.5}, svg);
+    }
+
+    Object.entries(data.locations).forEach(([loc, series], n) => {
+        const colour = COLOURS[n % COLOURS.length];
+        const xs = series.dates.map(d => dateX.get(d));
+        const values = series[panel.series];
+
+        if (panel.range) {
+            const lows = values.map(v => y(v[0])), highs = values.map(v => y(v[1]));
+            el("polygon", {points: points(xs, highs) + " " + points(xs.slice().reverse(), lows.slice().reverse()),
+                           fill: colour, opacity: 0.2}, svg);
+            el("polyline", {points: points(xs, values.map(v => y(0.5 * (v[0] + v[1])))), fill: "none", stroke: colour}, svg);
+        } else {
+            const ys = values.map(y);
+            el("polygon", {points: `${xs[0]},${y(0)} ${points(xs, ys)} ${xs[xs.length - 1]},${y(0)}`, fill: colour, opacity: 0.2}, svg);
+            el("polyline", {points: points(xs, ys), fill: "none", stroke: colour}, svg);
+            el("polyline", {points: points(xs, series[panel.dashed].map(y)), fill: "none", stroke: colour, "stroke-dasharray": "5 3"}, svg);
+        }
+
+        // Hovering a point shows the date and value, plus wind direction on the wind panel
+        series.dates.forEach((d, i) => {
+            const v = values[i], mid = panel.range ? 0.5 * (v[0] + v[1]) : v;
+            const dot = el("circle", {cx: xs[i], cy: y(mid), r: 3, fill: colour}, svg);
+            const note = panel.note ? " " + series[panel.note][i] : "";
+            el("title", {}, dot).textContent = `${loc} ${d}: ${panel.range ? v.join("-") : v}${note}`;
+        });
+    });
+
+    return svg;
+}
+
+function drawLegend(data) {
+    const legend = document.createElement("p");
+    Object.keys(data.locations).forEach((loc, n) => {
+        const item = document.createElement("span");
+        item.style.color = COLOURS[n % COLOURS.length];
+        item.style.marginRight = "1em";
+        item.textContent = "■ " + loc;
+        legend.appendChild(item);
+    });
+    return legend;
+}
+
+async function loadCharts(form, target) {
+    const params = new URLSearchParams();
+    for (const name of ["start", "end"]) {
+        if (form.elements[name].value) params.set(name, form.elements[name].value);
+    }
+
+    const response = await fetch(`${form.dataset.api}?${params}`);
+    if (!response.ok) {
+        target.textContent = await response.text();
+        return;
+    }
+
+    const data = await response.json();
+    const allDates = [...new Set(Object.values(data.locations).flatMap(s => s.dates))].sort();
+
+    target.replaceChildren(drawLegend(data), ...PANELS.map(p => drawPanel(p, data, allDates)));
+}
+
+document.addEventListener("DOMContentLoaded", () => {
+    const form = document.getElementById("chart-range");
+    const target = document.getElementById("charts");
+
+    // Default to the last 30 days, plus whatever is forecast ahead
+    const start = new Date(Date.now() - 30 * 24 * 3600 * 1000);
+    form.elements.start.value = start.toISOString().slice(0, 10);
+
+    form.addEventListener("submit", e => {
+        e.preventDefault();
+        loadCharts(form, target);
+    });
+    loadCharts(form, target);
+});
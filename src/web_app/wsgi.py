@@ -0,0 +1,24 @@
+import logging
+
+from src.web_app.app import app
+from src.web_app.charts import prepared_series
+from src.web_app.mwis_database import forecast_cache
+from src.web_app.mwis_utils import score_cache
+
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up() -> None:
+    """Load everything the workers share into the master process before it forks, so that each worker
+    starts with it in memory shared copy-on-write. Importing app has already loaded the spaCy model, this
+    fills in the forecast cache and the prepared chart series.
+    """
+    snapshot = forecast_cache.snapshot()
+    prepared_series(snapshot)
+
+    # A SQLite connection must not be used on both sides of a fork, each worker opens its own
+    forecast_cache.close()
+    score_cache.close()
+
+    logger.info(f"Preloaded {snapshot.num_rows} forecasts for version {snapshot.version}")
@@ -0,0 +1,70 @@
+import importlib.util
+
+import pytest
+import spacy
+from spacy.language import Language
+
+
+# mwis_utils loads this model on import. Where it is not installed, e.g. in CI, a blank English pipeline stands
+# in for it, so the scoring and chart code still runs. Without a tagger or parser fewer modifiers are found, so
+# tests compare scores from different code paths rather than against fixed values.
+SPACY_MODEL = "en_core_web_md"
+
+
+@Language.component("lowercase_lemmas")
+def lowercase_lemmas(doc):
+    """Lemmas for a pipeline without a lemmatizer: the lowercased word, without a plural s"""
+    for token in doc:
+        word = token.lower_
+        token.lemma_ = word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+    return doc
+
+
+def blank_pipeline(name, *args, **kwargs):
+    nlp = spacy.blank("en")
+    nlp.add_pipe("lowercase_lemmas")
+    return nlp
+
+
+if importlib.util.find_spec(SPACY_MODEL) is None:
+    load_installed_model = spacy.load
+
+    def load_model_or_blank_pipeline(name, *args, **kwargs):
+        loader = blank_pipeline if name == SPACY_MODEL else load_installed_model
+        return loader(name, *args, **kwargs)
+
+    spacy.load = load_model_or_blank_pipeline
+
+
+@pytest.fixture
+def mwis_database(tmp_path, monkeypatch):
+    """An empty database, with HOME pointed at tmp_path so that every path in src/utils.py is under it"""
+    from src.database_functions import setup_database
+
+    monkeypatch.setenv("HOME", str(tmp_path))
+    setup_database()
+
+
+def swapped_score_cache(directory):
+    """Precipitation scores saved under directory rather than the user's data directory, starting from nothing"""
+    from src.web_app import mwis_utils
+    from src.web_app.precip_score_cache import PrecipScoreCache
+
+    original = mwis_utils.score_cache
+    mwis_utils.score_cache = PrecipScoreCache(directory / "nlp_scores.db", original.fingerprint)
+    mwis_utils._normalised_precip_scores.cache_clear()
+    yield mwis_utils.score_cache
+    mwis_utils.score_cache.close()
+    mwis_utils.score_cache = original
+    mwis_utils._normalised_precip_scores.cache_clear()
+
+
+@pytest.fixture
+def empty_score_cache(tmp_path):
+    yield from swapped_score_cache(tmp_path)
+
+
+@pytest.fixture(scope="module")
+def module_score_cache(tmp_path_factory):
+    """As empty_score_cache, shared by the tests of a module, e.g. for module scoped snapshots"""
+    yield from swapped_score_cache(tmp_path_factory.mktemp("scores"))
@@ -0,0 +1,64 @@
+import datetime
+
+import pytest
+
+from src.database_functions import add_mwis_forecast_to_database
+from src.mwis_forecast import MwisForecast
+from src.mwis_maintenance import archive_forecasts
+from src.utils import database_cache_path
+from src.web_app import app as web_app
+from src.web_app.mwis_database import ForecastCache
+
+
+@pytest.fixture
+def client(mwis_database, monkeypatch):
+    """Test client for the web app reading the database under tmp_path"""
+    monkeypatch.setattr(web_app, "forecast_cache", ForecastCache(database_cache_path()))
+    return web_app.app.test_client()
+
+
+@pytest.mark.parametrize("query", ["days=0", "days=99999999", "days=-7", "days=week",
+                                   "season=0", "season=1899", "season=9999", "season=10000"])
+def test_chart_windows_which_are_not_dates_are_bad_requests(client, query):
+    assert client.get(f"/charts/wind.png?{query}").status_code == 400
+    assert client.get(f"/main_image.png?{query}").status_code == 400
+
+
+def make_forecasts(first_day: datetime.date, num_days: int):
+    """Forecasts issued on each of num_days days, one to three days ahead, which overlap from day to day"""
+    forecasts = []
+    for day in range(num_days):
+        published = first_day + datetime.timedelta(days=day)
+        for days_ahead in range(1, 4):
+            forecast = MwisForecast()
+            forecast.location = "west-highlands"
+            forecast.date = str(published + datetime.timedelta(days=days_ahead - 1))
+            forecast.days_ahead = days_ahead
+            forecast.freezing_level = f"{600 + 50 * day + 10 * days_ahead} metres"
+            forecast.how_windy = f"Westerly {10 + day} to {25 + day}mph"
+            forecast.chance_cloud_free = f"{10 * days_ahead}%"
+            forecast.how_wet = ["Rain at times, heavy.", "Snow showers."][day % 2]
+            forecasts.append(forecast)
+
+    return forecasts
+
+
+def test_archived_seasons_are_still_charted(client):
+    # The 2022/23 season, and the start of 2023/24
+    add_mwis_forecast_to_database(make_forecasts(datetime.date(2023, 1, 5), 10) +
+                                  make_forecasts(datetime.date(2023, 10, 1), 10))
+
+    requests = ["/api/chart_data?start=2023-01-01&end=2023-01-31", "/api/chart_data",
+                "/main_image.png?season=2022", "/charts/wind.png?start=2023-01-01&end=2023-01-31", "/main_image.png"]
+    before = [client.get(path) for path in requests]
+
+    assert archive_forecasts(datetime.date(2023, 10, 15)) > 0
+    after = [client.get(path) for path in requests]
+
+    for path, old, new in zip(requests, before, after):
+        assert new.status_code == 200, path
+        if path.startswith("/api"):
+            assert len(old.json["locations"]["west-highlands"]["dates"]) > 0
+            assert new.json["locations"] == old.json["locations"], path
+        else:
+            assert new.data == old.data, path
@@ -0,0 +1,39 @@
+import multiprocessing
+
+from src.web_app import metrics
+from src.web_app.metrics import REQUEST_SECONDS, REQUESTS
+
+
+def handle_requests(shared_dir, num_requests):
+    """A worker process: counts its own requests only, and writes them to shared_dir"""
+    metrics.reset_metrics()
+    metrics.share_between_processes(shared_dir, interval=None)
+
+    for _ in range(num_requests):
+        REQUESTS.inc("chart_data", "200")
+        REQUEST_SECONDS.observe(0.02, "chart_data")
+
+    metrics.write_process_metrics()
+
+
+def test_exposition_adds_up_every_process(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "_shared_dir", None)
+    metrics.reset_metrics()
+
+    workers = [multiprocessing.get_context("fork").Process(target=handle_requests, args=(tmp_path, n)) for n in (3, 4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    # The process answering the scrape, which has handled a request of its own
+    metrics.share_between_processes(tmp_path, interval=None)
+    REQUESTS.inc("chart_data", "200")
+    REQUEST_SECONDS.observe(2.0, "chart_data")
+
+    lines = metrics.exposition().splitlines()
+    metrics.reset_metrics()
+
+    assert 'mwis_http_requests_total{endpoint="chart_data",status="200"} 8' in lines
+    assert 'mwis_http_request_duration_seconds_bucket{endpoint="chart_data",le="0.025"} 7' in lines
+    assert 'mwis_http_request_duration_seconds_count{endpoint="chart_data"} 8' in lines
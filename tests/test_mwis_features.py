@@ -0,0 +1,75 @@
+import datetime
+
+import pytest
+
+from src.database_connection import database_connection
+from src.database_functions import add_mwis_forecast_to_database
+from src.mwis_features import update_features
+from src.mwis_forecast import MwisForecast
+from src.utils import database_cache_path
+from src.web_app import charts
+from src.web_app.mwis_database import ForecastCache
+
+
+FIRST_DAY = datetime.date(2023, 1, 5)
+
+
+def make_forecasts():
+    forecasts = []
+    for day in range(10):
+        for location in ["west-highlands", "southeastern-highlands"]:
+            forecast = MwisForecast()
+            forecast.location = location
+            forecast.date = str(FIRST_DAY + datetime.timedelta(days=day))
+            forecast.days_ahead = 1
+            forecast.freezing_level = f"{600 + 50 * day} metres, rising to {900 + 50 * day}m"
+            forecast.how_windy = f"Westerly {10 + day} to {25 + day}mph"
+            forecast.chance_cloud_free = f"{day * 10}%"
+            forecast.how_wet = ["Rain at times, heavy.", "Snow showers.", "Showers of rain and snow."][day % 3]
+            forecasts.append(forecast)
+
+    return forecasts
+
+
+def load_snapshot():
+    cache = ForecastCache(database_cache_path())
+    snapshot = cache.snapshot()
+    cache.close()
+    return snapshot
+
+
+def from_text(snapshot):
+    """Every series converted from the forecast text"""
+    return {name: preparation(snapshot._replace(features={})) for name, preparation in charts.SERIES_PREPARATION.items()}
+
+
+def not_converted(text):
+    raise RuntimeError(f"Converted {text} rather than reading its features")
+
+
+@pytest.fixture
+def database(mwis_database, empty_score_cache):
+    add_mwis_forecast_to_database(make_forecasts())
+    update_features()
+
+
+def test_chart_series_are_read_from_features(database, monkeypatch):
+    snapshot = load_snapshot()
+    expected = from_text(snapshot)
+    assert len(snapshot.features) == snapshot.num_rows
+
+    for converter in ["freezing_level_to_numeric", "wind_to_numeric", "get_wind_direction", "cloud_to_numeric",
+                      "how_wet_to_numeric", "how_snowy_to_numeric"]:
+        monkeypatch.setattr(charts, converter, not_converted)
+
+    assert {name: preparation(snapshot) for name, preparation in charts.SERIES_PREPARATION.items()} == expected
+
+
+def test_forecasts_without_features_are_converted_from_text(database):
+    with database_connection() as conn:
+        conn.execute("DELETE FROM mwis_features WHERE mwis_id % 3 = 0")
+
+    snapshot = load_snapshot()
+    assert 0 < len(snapshot.features) < snapshot.num_rows
+
+    assert {name: preparation(snapshot) for name, preparation in charts.SERIES_PREPARATION.items()} == from_text(snapshot)
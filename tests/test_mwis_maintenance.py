@@ -0,0 +1,47 @@
+import datetime
+
+from src.database_connection import database_connection
+from src.database_functions import add_mwis_forecast_to_database
+from src.mwis_forecast import MwisForecast
+from src.mwis_maintenance import archive_forecasts
+from src.mwis_queries import run_scalar_query
+
+
+TODAY = datetime.date(2023, 10, 15)  # Early in the 2023/24 season
+
+
+def make_forecasts(location: str, published: datetime.date):
+    """The three forecasts on one day's page, as the scraper would extract them"""
+    forecasts = []
+    for days_ahead in range(1, 4):
+        forecast = MwisForecast()
+        forecast.location = location
+        forecast.date = str(published + datetime.timedelta(days=days_ahead - 1))
+        forecast.days_ahead = days_ahead
+        forecast.how_wet = f"Showers, published {published}"
+        forecasts.append(forecast)
+
+    return forecasts
+
+
+def count(query_name: str) -> int:
+    with database_connection() as conn:
+        return run_scalar_query(conn, query_name)
+
+
+def test_archived_forecasts_are_not_added_again(mwis_database):
+    # Last season's forecasts, and this season's pages up to today, each overlapping the next
+    forecasts = make_forecasts("west-highlands", datetime.date(2023, 3, 1))
+    for day in range(5):
+        forecasts += make_forecasts("west-highlands", TODAY - datetime.timedelta(days=day))
+
+    add_mwis_forecast_to_database(forecasts)
+    num_forecasts = count("count_forecasts")
+
+    assert archive_forecasts(TODAY) > 0
+    assert count("count_hot_forecasts") < num_forecasts
+
+    # As when the scraper sees the same pages again, or a page is reparsed
+    add_mwis_forecast_to_database(forecasts)
+
+    assert count("count_forecasts") == num_forecasts
@@ -0,0 +1,60 @@
+import datetime
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from src import page_archive, scrape_latest_mwis
+from src.columnar_export import export_mwis_table, load_mwis_export
+from src.database_connection import database_connection
+from src.database_functions import add_mwis_forecast_to_database
+from src.mwis_forecast import MwisForecast
+from src.mwis_queries import run_scalar_query
+
+
+PAGES = [("west-highlands", b"2023-01-05"), ("west-highlands", b"2023-01-06"), ("southeastern-highlands", b"2023-01-05")]
+
+
+def extract_forecasts_from_date(location, content, all_forecasts, parser=None):
+    """Stands in for the HTML extraction: three forecasts from the date a page was published"""
+    published = datetime.date.fromisoformat(content.decode())
+
+    for days_ahead in range(1, 4):
+        forecast = MwisForecast()
+        forecast.location = location
+        forecast.date = str(published + datetime.timedelta(days=days_ahead - 1))
+        forecast.days_ahead = days_ahead
+        forecast.how_wet = f"Showers, published {published}"
+        all_forecasts.append(forecast)
+
+
+@pytest.fixture
+def database(mwis_database, monkeypatch):
+    """Archived pages, whose forecasts the scraper has already added"""
+    monkeypatch.setattr(scrape_latest_mwis, "extract_forecasts_for_area", extract_forecasts_from_date)
+    monkeypatch.setattr(page_archive, "ProcessPoolExecutor", ThreadPoolExecutor)
+
+    forecasts = []
+    for location, content in PAGES:
+        page_archive.archive_page(location, "https://example.org", content, hashlib.sha256(content).hexdigest())
+        extract_forecasts_from_date(location, content, forecasts)
+
+    add_mwis_forecast_to_database(forecasts)
+
+
+def count_forecasts() -> int:
+    with database_connection() as conn:
+        return run_scalar_query(conn, "count_forecasts")
+
+
+def test_export_after_reparse_has_each_forecast_once(database):
+    assert export_mwis_table() == count_forecasts()
+
+    page_archive.reparse_archive(max_workers=1)
+
+    assert export_mwis_table() == count_forecasts()
+    exported = load_mwis_export()
+    assert len(exported) == count_forecasts()
+    assert not exported.duplicated(["location", "date", "days_ahead"]).any()
@@ -0,0 +1,60 @@
+import sqlite3
+
+from src.web_app.precip_score_cache import PrecipScoreCache, rules_fingerprint
+
+
+SCORES = {"Rain at times, heavy.": (4, 0), "Snow showers.": (0, 3), "Cloudy with clear spells.": None}
+
+
+def stored_fingerprints(db_path):
+    with sqlite3.connect(str(db_path)) as conn:
+        return dict(conn.execute("SELECT fingerprint, count(*) FROM precip_scores GROUP BY fingerprint").fetchall())
+
+
+def test_texts_not_yet_scored_are_missing_from_lookup(tmp_path):
+    cache = PrecipScoreCache(tmp_path / "nlp_scores.db", "rules-1")
+    cache.store({"Dry.": (0, 0)})
+
+    assert cache.lookup(["Dry.", "Snow showers."]) == {"Dry.": (0, 0)}
+
+
+def test_stored_scores_are_found_after_a_restart(tmp_path):
+    cache = PrecipScoreCache(tmp_path / "nlp_scores.db", "rules-1")
+    for text, scores in SCORES.items():
+        cache.store({text: scores})  # One at a time, as on a web request
+    cache.close()
+
+    restarted = PrecipScoreCache(tmp_path / "nlp_scores.db", "rules-1")
+
+    assert restarted.lookup(SCORES) == SCORES
+
+
+def test_changed_rules_score_again_and_delete_old_rows(tmp_path):
+    db_path = tmp_path / "nlp_scores.db"
+    PrecipScoreCache(db_path, "rules-1").store(SCORES)
+
+    cache = PrecipScoreCache(db_path, "rules-2")
+
+    assert cache.lookup(SCORES) == {}
+    assert stored_fingerprints(db_path) == {}
+
+    cache.store({"Dry.": (0, 0)})
+    assert stored_fingerprints(db_path) == {"rules-2": 1}
+
+
+def test_unreadable_file_keeps_scores_in_memory(tmp_path):
+    not_a_directory = tmp_path / "file"
+    not_a_directory.write_text("")
+    cache = PrecipScoreCache(not_a_directory / "nlp_scores.db", "rules-1")
+
+    assert cache.lookup(SCORES) == {}
+
+    cache.store(SCORES)
+    assert cache.lookup(SCORES) == SCORES
+
+
+def test_fingerprint_depends_on_contents_not_set_order():
+    rules = {"quantity_adjs": {"heavy": 4}, "precip_tokens": {"rain", "snow"}}
+
+    assert rules_fingerprint(**rules) == rules_fingerprint(quantity_adjs={"heavy": 4}, precip_tokens={"snow", "rain"})
+    assert rules_fingerprint(**rules) != rules_fingerprint(quantity_adjs={"heavy": 5}, precip_tokens={"rain", "snow"})
@@ -0,0 +1,84 @@
+import pytest
+
+from src.mwis_features import compute_features
+from src.web_app import mwis_utils
+from src.web_app.mwis_utils import precip_scores, precip_scores_batch
+from src.web_app.precip_score_cache import PrecipScoreCache
+
+
+# Every test parses from scratch
+pytestmark = pytest.mark.usefixtures("empty_score_cache")
+
+HOW_WET = ["Dry.",
+           "Rain at times, heavy.",
+           "Snow showers, heavy and frequent.",
+           "Showers of rain and snow, heavy at times.",
+           "Occasional light drizzle; dry later.",
+           "No rain expected.",
+           "Rain  at times,   heavy.",  # Same text once whitespace is collapsed
+           "Cloudy with clear spells.",  # No precipitation terms
+           "Dry."]
+
+
+def one_at_a_time(text):
+    try:
+        return precip_scores(text)
+    except AssertionError:
+        return None
+
+
+def use_new_score_cache(name: str) -> None:
+    """Switch to another empty cache, so that the next scores are parsed rather than read from the last ones"""
+    mwis_utils.score_cache = PrecipScoreCache(mwis_utils.score_cache.db_path.with_name(name),
+                                              mwis_utils.score_cache.fingerprint)
+
+
+def test_batch_matches_scoring_one_text_at_a_time():
+    expected = [one_at_a_time(text) for text in HOW_WET]
+
+    use_new_score_cache("batch.db")
+    assert precip_scores_batch(HOW_WET, batch_size=2) == expected
+
+
+def test_batch_scores_texts_without_precipitation_as_none():
+    scores = precip_scores_batch(HOW_WET)
+
+    assert scores[HOW_WET.index("Cloudy with clear spells.")] is None
+    with pytest.raises(AssertionError):
+        precip_scores("Cloudy with clear spells.")
+
+
+def test_features_from_batch_scores_match_per_text_scores():
+    texts = ("Freezing level above the summits", "Westerly 20 to 30mph", "60%")
+    expected = [one_at_a_time(how_wet) or (None, None) for how_wet in HOW_WET]
+
+    use_new_score_cache("batch.db")
+    features = [compute_features(*texts, scores) for scores in precip_scores_batch(HOW_WET)]
+
+    assert [f[-2:] for f in features] == expected
+
+
+class NoParsing:
+    """Stands in for the spaCy pipeline where nothing should be parsed"""
+    def __call__(self, text):
+        raise RuntimeError(f"Parsed {text}")
+
+    def pipe(self, texts, **kwargs):
+        texts = list(texts)
+        if texts:
+            raise RuntimeError(f"Parsed {texts}")
+        return iter(())
+
+
+def test_scores_saved_by_one_run_are_not_parsed_again_by_the_next(monkeypatch):
+    expected = [one_at_a_time(text) for text in HOW_WET]
+
+    # As after a restart: nothing in memory, only the file
+    mwis_utils.score_cache.close()
+    mwis_utils.score_cache = PrecipScoreCache(mwis_utils.score_cache.db_path, mwis_utils.score_cache.fingerprint)
+    mwis_utils._normalised_precip_scores.cache_clear()
+    monkeypatch.setattr(mwis_utils, "nlp", NoParsing())
+
+    assert [one_at_a_time(text) for text in HOW_WET] == expected
+    assert precip_scores_batch(HOW_WET) == expected
+
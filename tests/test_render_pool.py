@@ -0,0 +1,84 @@
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.web_app import charts
+from src.web_app.charts import PANELS, get_panel_image
+from src.web_app.mwis_database import EMPTY_SNAPSHOT, apply_new_rows
+from src.web_app.render_pool import RenderPool
+
+
+LOCATIONS = ["cairngorms-np-and-monadhliath", "west-highlands"]
+START, END = "2022-12-01", "2022-12-30"
+NUM_THREADS = 8
+
+pytestmark = pytest.mark.usefixtures("module_score_cache")
+
+
+def make_snapshot():
+    rows = []
+    first_day = datetime.date.fromisoformat(START)
+
+    for day in range(30):
+        for location in LOCATIONS:
+            rows.append({"id": len(rows) + 1,
+                         "location": location,
+                         "date": str(first_day + datetime.timedelta(days=day)),
+                         "days_ahead": "0",
+                         "freezing_level": f"{600 + 20 * day} metres, rising to {900 + 20 * day}m",
+                         "how_windy": f"Southwesterly {10 + day % 7} to {25 + day % 11}mph",
+                         "chance_cloud_free": f"{day % 5 * 20}%",
+                         "how_wet": ["Dry.", "Rain at times, heavy.", "Snow showers."][day % 3]})
+
+    return apply_new_rows(EMPTY_SNAPSHOT, rows)
+
+
+def render_panel(panel, snapshot) -> bytes:
+    return get_panel_image(panel, snapshot, START, END).getvalue()
+
+
+@pytest.fixture(scope="module")
+def snapshot():
+    return make_snapshot()
+
+
+@pytest.fixture(scope="module")
+def serial_images(snapshot):
+    return {panel: render_panel(panel, snapshot) for panel in PANELS}
+
+
+@pytest.mark.parametrize("panel", ["freezing_level", "wind"])
+def test_same_panel_from_many_threads_matches_serial_render(panel, snapshot, serial_images):
+    pool = RenderPool(workers=4, max_queued=NUM_THREADS)
+
+    with ThreadPoolExecutor(max_workers=NUM_THREADS) as clients:
+        images = list(clients.map(lambda _: pool.render(render_panel, panel, snapshot), range(NUM_THREADS)))
+
+    assert all(image == serial_images[panel] for image in images)
+
+
+def test_different_panels_at_once_match_serial_renders(snapshot, serial_images):
+    pool = RenderPool(workers=4, max_queued=NUM_THREADS)
+    panels = [panel for panel in PANELS for _ in range(2)]
+
+    with ThreadPoolExecutor(max_workers=NUM_THREADS) as clients:
+        images = list(clients.map(lambda panel: pool.render(render_panel, panel, snapshot), panels))
+
+    assert [serial_images[panel] for panel in panels] == images
+
+
+def not_prepared(snapshot):
+    raise RuntimeError("Precipitation series prepared for a panel which does not draw them")
+
+
+@pytest.mark.parametrize("panel", ["freezing_level", "wind", "cloud"])
+def test_panels_without_precipitation_do_not_score_it(panel, snapshot, serial_images, monkeypatch):
+    # A new version, so that no series of it has been prepared yet
+    row = dict(snapshot.latest[LOCATIONS[0]][-1], id=snapshot.max_id + 1, days_ahead="1")
+    updated = apply_new_rows(snapshot, [row])
+
+    monkeypatch.setitem(charts.SERIES_PREPARATION, "rain", not_prepared)
+    monkeypatch.setitem(charts.SERIES_PREPARATION, "snow", not_prepared)
+
+    assert render_panel(panel, updated) == serial_images[panel]